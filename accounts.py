@@ -0,0 +1,139 @@
+"""
+Account configuration for the EC2 scheduled events notification engine (ec2_scheduled_events.py).
+
+Each account defines how to reach it (an AWS CLI profile or a role ARN to assume), the summary log
+file, the MS Teams card title and the routing rules that resolve the support team DL of an event
+report (see routing.py for the rule format).
+
+Note:
+    When both profile and role_arn are set, the role is assumed using the profile credentials.
+    Leaving both unset uses the default credential chain.
+
+"""
+
+# Default recipient when no routing rule matches (ST SysAdmin team)
+DEFAULT_RECIPIENT = 'DL-TEAM-CLOUD-OPS-SYSADMINS@infor.com'
+
+CHAT_CHANNEL = "https://outlook.office.com/webhook/842cbb15-9b3d-4c21-8195-c0e5920fb36e@457d5685-0467-4d05-b23b-8f817adda47c/IncomingWebhook/19d39580cfae4cd59a3cdbf2546bbf4d/4aacf2c9-44ca-48cf-bf6f-8475b6000a8e"
+
+
+# Support teams DL
+DBA_RECIPIENT = 'DL-TEAM-CLOUD-OPS-MONITORING-DBA@infor.com'
+LN_RECIPIENT = 'DL-TEAM-CLOUD-OPS-SAAS-LN@infor.com'
+M3_RECIPIENT = 'DL-TEAM-CLOUD-OPS-CMS-M3-SYSADM-MNL@infor.com'
+M_GADDI_RECIPIENT = 'DL-TEAM-mgaddissa-Chart@infor.com'
+LAWSON_RECIPIENT = 'DL-TEAM-LE-TIGER@infor.com'
+WFM_RECIPIENT = 'DLG-NA-ICSOnCall-WFM-CRM@Infor.com'
+COGC_RECIPIENT = 'DLG-INHY-AMS-TC-CoGC@infor.com'
+
+
+# Routing for STAMS and STHYBRID (Filtered through CostCenter and Service tags)
+CLOUDSUITE_ROUTING = {
+    'rules': [
+        {'conditions': [('CostCenter', 'present'), ('Service', 'contains', ['db'])], 'recipient': DBA_RECIPIENT},
+        {'conditions': [('CostCenter', 'in', ['CloudSuite A&D', 'CloudSuite AND', 'Cloudsuite Automotive', 'CloudSuite Industrial Machinery',
+                                              'CloudSuite LN Base', 'CloudSuite LN Hybrid'])],
+         'recipient': LN_RECIPIENT},
+        {'conditions': [('CostCenter', 'in', ['Cloud Suite M3 Base', 'CloudSuite Food & Beverage', 'CloudSuite Food and Beverage', 'CloudSuite M3 Base',
+                                              'CloudSuite M3 Hybrid', 'M3 Traditional'])],
+         'recipient': M3_RECIPIENT},
+        {'conditions': [('CostCenter', 'in', ['Cloudsuite Business', 'CloudSuite Cloverleaf', 'Cloudsuite GENERICPRODUCT', 'CloudSuite IBP',
+                                              'CloudSuite Marketing', 'CloudSuite Optiva', 'CLOUDSUITE SCE', 'Cloudsuite SICRM', 'CloudSuite ST IIH',
+                                              'Cloudsuite SunSystems', 'CloudSuite XI', 'CloudsuiteDRGDE', 'CUSTOMSTACK', 'Infor SunSystems',
+                                              'IPD-DVLEZ', 'ips', 'Single Tenant BI and dEPM'])],
+         'recipient': M_GADDI_RECIPIENT},
+        {'conditions': [('CostCenter', 'in', ['CloudSuite Corporate Base', 'CloudSuite Corporate Enterprise Edition', 'CloudSuite HealthCare',
+                                              'CloudSuite Industrial Enterprise', 'NonCloudSuite Lawson'])],
+         'recipient': LAWSON_RECIPIENT},
+        {'conditions': [('CostCenter', 'in', ['CloudSuite WFM', 'WFM'])], 'recipient': WFM_RECIPIENT},
+        {'conditions': [('CostCenter', 'in', ['INFRA', 'UtilityServer'])], 'recipient': DEFAULT_RECIPIENT}
+    ],
+    # Will default to ST SysAdmin team if no CostCenter tag has been found or it is not within the lists
+    'default': DEFAULT_RECIPIENT
+}
+
+# Routing for STCOGC (Filtered through CostCenter tags)
+STCOGC_ROUTING = {
+    'rules': [
+        {'conditions': [('CostCenter', 'in', ['CloudSuite XI', 'CloudsuiteDRGDE'])], 'recipient': COGC_RECIPIENT}
+    ],
+    'default': DEFAULT_RECIPIENT
+}
+
+# Routing for STCS (Filtered through Product, Service and Owner tags)
+STCS_ROUTING = {
+    'rules': [
+        # Products that are identical for M3 and Lawson app servers, checked through the Owner tag
+        {'conditions': [('Product', 'in', ['bi', 'ies', 'mingle']), ('Owner', 'contains', ['m3', 'crea'])], 'recipient': M3_RECIPIENT},
+        {'conditions': [('Product', 'in', ['bi', 'ies', 'mingle']), ('Owner', 'contains', ['tarek', 'tiger'])], 'recipient': LAWSON_RECIPIENT},
+        {'conditions': [('Product', 'in', ['bi', 'ies', 'mingle'])], 'recipient': DEFAULT_RECIPIENT},
+        # Server's product based on Product tags
+        {'conditions': [('Product', 'in', ['pubapp', 'ion', 'iso', 'lmrk', 'lsf', 'cb', 'depm', 'gfc', 'eam', 'mscm'])], 'recipient': LAWSON_RECIPIENT},
+        {'conditions': [('Product', 'in', ['m3', 'ft', 'glt', 'm3base', 'Mongoose', 'olap', 'plm', 'clm'])], 'recipient': M3_RECIPIENT},
+        {'conditions': [('Product', 'in', ['infra'])], 'recipient': DEFAULT_RECIPIENT},
+        {'conditions': [('Product', 'in', ['WFM'])], 'recipient': WFM_RECIPIENT},
+        {'conditions': [('Product', 'contains', ['db'])], 'recipient': DBA_RECIPIENT},
+        {'conditions': [('Product', 'present')], 'recipient': DEFAULT_RECIPIENT},
+        # Servers without Product tag, checked through the Service and Owner tags
+        {'conditions': [('Service', 'in', ['db-mssql', 'db-postgres'])], 'recipient': DBA_RECIPIENT},
+        {'conditions': [('Owner', 'contains', ['m3', 'crea'])], 'recipient': M3_RECIPIENT},
+        {'conditions': [('Owner', 'contains', ['tarek', 'tiger'])], 'recipient': LAWSON_RECIPIENT}
+    ],
+    'default': DEFAULT_RECIPIENT
+}
+
+# Routing for STLAWSON (Filtered through CostCenter and Service tags)
+STLAWSON_ROUTING = {
+    'rules': [
+        {'conditions': [('CostCenter', 'present'), ('Service', 'contains', ['db'])], 'recipient': DBA_RECIPIENT},
+        {'conditions': [('CostCenter', 'in', ['M3 Traditional'])], 'recipient': M3_RECIPIENT},
+        {'conditions': [('CostCenter', 'in', ['NonCloudSuite Lawson'])], 'recipient': LAWSON_RECIPIENT},
+        {'conditions': [('CostCenter', 'in', ['Cloudsuite WFM', 'WFM'])], 'recipient': WFM_RECIPIENT},
+        {'conditions': [('CostCenter', 'in', ['INFRA'])], 'recipient': DEFAULT_RECIPIENT}
+    ],
+    'default': DEFAULT_RECIPIENT
+}
+
+
+ACCOUNTS = {
+    'STAMS': {
+        'profile': 'stams',
+        'role_arn': None,
+        'log_file': 'ScheduledEvents_summary.log',
+        'card_title': 'EC2 Scheduled report - STAMS',
+        'chat_channel': CHAT_CHANNEL,
+        'routing': CLOUDSUITE_ROUTING
+    },
+    'STCOGC': {
+        'profile': 'stcogc',
+        'role_arn': None,
+        'log_file': 'ScheduledEvents_summary.log',
+        'card_title': 'EC2 Scheduled report - STCOGC',
+        'chat_channel': CHAT_CHANNEL,
+        'routing': STCOGC_ROUTING
+    },
+    'STCS': {
+        'profile': 'stcs',
+        'role_arn': None,
+        'log_file': 'ScheduledEvents_summary.log',
+        'card_title': 'EC2 Scheduled report - STCS',
+        'chat_channel': CHAT_CHANNEL,
+        'routing': STCS_ROUTING
+    },
+    'STHYBRID': {
+        'profile': 'sthybrid',
+        'role_arn': None,
+        'log_file': 'ScheduledEvents_summary.log',
+        'card_title': 'EC2 Scheduled report - STHYBRID',
+        'chat_channel': CHAT_CHANNEL,
+        'routing': CLOUDSUITE_ROUTING
+    },
+    'STLAWSON': {
+        'profile': 'stlawson',
+        'role_arn': None,
+        'log_file': 'ScheduledEvents_STLAWSON_summary.log',
+        'card_title': 'EC2 Scheduled report - STLAWSON',
+        'chat_channel': CHAT_CHANNEL,
+        'routing': STLAWSON_ROUTING
+    }
+}
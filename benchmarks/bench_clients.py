@@ -0,0 +1,90 @@
+"""
+Micro-benchmark of the engine startup and of the client creation.
+
+Usage:
+    python benchmarks/bench_clients.py [--accounts 5] [--regions 17] [--imports 5]
+
+The import time of ec2_scheduled_events is measured in fresh interpreters. EC2 clients are then created for every
+region of every account (static credentials, no call is made) three ways: a new session for every client, one
+session per account, and the client factory (one session per account sharing a single data loader, clients cached).
+The time per client is reported for each.
+
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from time import perf_counter
+
+import botocore.session
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from client_factory import ClientFactory
+
+REGIONS = ['us-east-1', 'us-east-2', 'us-west-1', 'us-west-2', 'ca-central-1', 'sa-east-1', 'eu-west-1', 'eu-west-2',
+           'eu-west-3', 'eu-central-1', 'eu-north-1', 'ap-south-1', 'ap-southeast-1', 'ap-southeast-2', 'ap-northeast-1',
+           'ap-northeast-2', 'ap-northeast-3']
+
+
+# Function to create a session with static credentials, outside of the factory
+def create_session():
+
+    session = botocore.session.Session()
+    session.set_credentials('bench', 'bench')
+    return session
+
+
+# Function to measure the import time of the engine in a fresh interpreter
+def measure_import():
+
+    code = 'from time import perf_counter; start = perf_counter(); import ec2_scheduled_events; print(perf_counter() - start)'
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+    return float(output)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--accounts', type=int, default=5)
+    parser.add_argument('--regions', type=int, default=len(REGIONS))
+    parser.add_argument('--imports', type=int, default=5, help='fresh interpreters timing the engine import')
+    args = parser.parse_args()
+    regions = REGIONS[:args.regions]
+    clients = args.accounts * len(regions)
+
+    imports = sorted(measure_import() for _ in range(args.imports))
+    print("Engine import: {:.3f}s median, {:.3f}s min".format(imports[len(imports) // 2], imports[0]))
+
+    start = perf_counter()
+    for _ in range(args.accounts):
+        for region in regions:
+            create_session().create_client('ec2', region_name=region)
+    session_per_client = perf_counter() - start
+
+    start = perf_counter()
+    for _ in range(args.accounts):
+        session = create_session()
+        for region in regions:
+            session.create_client('ec2', region_name=region)
+    session_per_account = perf_counter() - start
+
+    start = perf_counter()
+    factory = ClientFactory()
+    for _ in range(args.accounts):
+        session = factory.create_session(credentials=('bench', 'bench'))
+        for region in regions:
+            factory.get_client(session, 'ec2', region)
+            # Later lookups of the same client (next pages, daemon cycles) are served from the cache
+            factory.get_client(session, 'ec2', region)
+    shared_loader = perf_counter() - start
+
+    print("{} EC2 clients ({} accounts x {} regions):".format(clients, args.accounts, len(regions)))
+    for label, elapsed in (('session per client', session_per_client), ('session per account', session_per_account),
+                           ('client factory', shared_loader)):
+        print("    {:<20} {:>7.3f}s ({:.1f} ms per client)".format(label, elapsed, elapsed * 1000 / clients))
+
+
+if __name__ == '__main__':
+    main()
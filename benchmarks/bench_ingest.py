@@ -0,0 +1,106 @@
+"""
+Offline benchmark of the event queue ingestion, run end to end through main() in daemon mode without any network access.
+
+Usage:
+    python benchmarks/bench_ingest.py [--fleet 4x500x1] [--events 50] [--rate 10] [--account STAMS]
+                                      [--engine-args="--digest"]
+
+The daemon runs against the synthetic fleet of bench_scan.py with --sqs-queue-url pointing at the SQS stand-in of
+the fake. Once its first scan is over, new scheduled events are added to the fleet at the given rate (events per
+second), each one announced by an AWS Health event queued the way EventBridge forwards it. The latency from the
+event being queued to its notification email, and the API requests made while ingesting, are reported.
+
+"""
+
+import argparse
+import os
+import shlex
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+from collections import Counter
+from contextlib import redirect_stdout
+from time import perf_counter, sleep
+
+from requests.adapters import HTTPAdapter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import ec2_scheduled_events as engine
+from bench_scan import ACCOUNT_ID, FakeAws, parse_fleet, send_teams_post
+
+QUEUE_URL = 'https://sqs.us-east-1.amazonaws.com/{}/aws-scheduled-events'.format(ACCOUNT_ID)
+
+
+# Function to get a percentile of sorted values
+def get_percentile(values, percentile):
+    return values[min(len(values) - 1, int(len(values) * percentile))] if values else 0.0
+
+
+# Function to publish the events once the first scan is over, then stop the daemon once they are all notified
+def publish_events(fake, events, rate, timeout, result):
+
+    while not fake.requests[('sqs', 'ReceiveMessage')]:
+        sleep(0.05)
+    result['scan'] = perf_counter() - result['start']
+    result['requests'] = Counter(fake.requests)
+
+    for index in range(events):
+        if fake.publish_event(fake.regions[index % len(fake.regions)]) is None:
+            break
+        sleep(1.0 / rate)
+
+    waited = 0.0
+    while fake.published and waited < timeout:
+        sleep(0.05)
+        waited += 0.05
+    result['requests'] = fake.requests - result['requests']
+    fake.close_queue()
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fleet', type=parse_fleet, default=(4, 500, 1), help='REGIONSxINSTANCESxEVENTS')
+    parser.add_argument('--events', type=int, default=50, help='events published through the queue')
+    parser.add_argument('--rate', type=float, default=10.0, help='events published per second')
+    parser.add_argument('--timeout', type=float, default=30.0, help='seconds to wait for the last notifications')
+    parser.add_argument('--tag-coverage', type=float, default=0.7)
+    parser.add_argument('--account', default='STAMS')
+    parser.add_argument('--engine-args', default='', help='extra arguments of ec2_scheduled_events.py')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    HTTPAdapter.send = send_teams_post
+    work_dir = tempfile.mkdtemp(prefix='bench_ingest_')
+    start_dir = os.getcwd()
+    regions, instances, events = args.fleet
+    fake = FakeAws(regions, instances, events, args.tag_coverage, seed=args.seed)
+    engine.create_account_session = fake.create_session
+    result = {'start': perf_counter()}
+    publisher = threading.Thread(target=publish_events, args=(fake, args.events, args.rate, args.timeout, result))
+    publisher.daemon = True
+    try:
+        os.chdir(work_dir)
+        publisher.start()
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            engine.main(['--account', args.account, '--daemon', '--interval', '3600', '--sqs-queue-url', QUEUE_URL] +
+                        shlex.split(args.engine_args))
+    finally:
+        os.chdir(start_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    latencies = sorted(fake.latencies)
+    print("Fleet {}x{}x{}: first scan {:.2f}s, {} events published, {} notified ({} missing)".format(
+        regions, instances, events, result['scan'], len(latencies) + len(fake.published), len(latencies), len(fake.published)))
+    print("Queue to email latency: {:.3f}s p50, {:.3f}s p95, {:.3f}s max".format(
+        get_percentile(latencies, 0.5), get_percentile(latencies, 0.95), latencies[-1] if latencies else 0.0))
+    for (service, operation), count in sorted(result['requests'].items()):
+        print("    {}.{}: {}".format(service, operation, count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Micro-benchmark of the notification renderer.
+
+Usage:
+    python benchmarks/bench_render.py [--rows 1,100,1000,10000] [--seed 1]
+
+Digest emails of synthetic events (tag values including characters to escape) are rendered with render_email,
+and the MS teams sections of the same events with render_section, reporting the time per call and per event.
+
+"""
+
+import argparse
+import os
+import random
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from change_detection import CLEARED, NEW, RESCHEDULED
+from render import render_email, render_section
+from scheduled_event import ScheduledEvent
+
+
+# Function to generate synthetic events with a mix of changes
+def generate_events(count, seed):
+
+    rng = random.Random(seed)
+    events = []
+    for index in range(count):
+        change = rng.choice((NEW, NEW, RESCHEDULED, CLEARED))
+        events.append(ScheduledEvent(
+            region='us-east-1a', account_id='123456789012', instance_id='i-{:017x}'.format(index),
+            description='The instance is running on degraded hardware', code='instance-retirement',
+            deadline='2026-11-{:02d} 00:00:00+00:00'.format(rng.randint(1, 28)), name='app<{}> & db'.format(index),
+            customer_prefix='cust{}'.format(rng.randint(1, 50)), recipient='DLG-NA-ICSOnCall@Infor.com', change=change,
+            previous_deadline='2026-10-31 00:00:00+00:00' if change == RESCHEDULED else None))
+
+    return events
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', default='1,100,1000,10000')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print("{:>8} {:>12} {:>14} {:>12} {:>16}".format('Rows', 'email (ms)', 'email (us/row)', 'body (KB)', 'section (us/row)'))
+    for rows in [int(rows) for rows in args.rows.split(',')]:
+        events = generate_events(rows, args.seed)
+
+        start = perf_counter()
+        subject, html_body, text_body = render_email(events)
+        email_time = perf_counter() - start
+
+        start = perf_counter()
+        for event in events:
+            render_section(event)
+        section_time = perf_counter() - start
+
+        print("{:>8} {:>12.3f} {:>14.2f} {:>12.1f} {:>16.2f}".format(
+            rows, email_time * 1000, email_time * 1e6 / rows, (len(html_body) + len(text_body)) / 1024.0,
+            section_time * 1e6 / rows))
+
+
+if __name__ == '__main__':
+    main()
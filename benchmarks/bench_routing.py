@@ -0,0 +1,83 @@
+"""
+Micro-benchmark of the routing engine over a synthetic inventory.
+
+Usage:
+    python benchmarks/bench_routing.py [--instances 100000] [--seed 1]
+
+A synthetic inventory of event reports is generated with a tag mix close to the real fleets (CostCenter, Service,
+Product and Owner values taken from the routing rules plus unknown values), then routed for every account with
+route() one report at a time and with route_batch().
+
+"""
+
+import argparse
+import os
+import random
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from accounts import ACCOUNTS
+from routing import compile_routing
+
+
+# Function to collect the tag values used by the routing rules of every account
+def get_rule_values():
+
+    values = {}
+    for account in ACCOUNTS.values():
+        for rule in account['routing']['rules']:
+            for condition in rule['conditions']:
+                if len(condition) > 2:
+                    values.setdefault(condition[0], set()).update(condition[2])
+
+    return {tag: sorted(tag_values) + ['unknown-{}'.format(tag.lower())] for tag, tag_values in values.items()}
+
+
+# Function to generate the synthetic inventory, each tag is set on about 70% of the instances
+def generate_inventory(instances, seed):
+
+    rng = random.Random(seed)
+    values = get_rule_values()
+    inventory = []
+    for index in range(instances):
+        report = {'InstanceID': 'i-{:017x}'.format(index), 'Name': 'server-{}'.format(index)}
+        for tag, tag_values in values.items():
+            if rng.random() < 0.7:
+                report[tag] = rng.choice(tag_values)
+        inventory.append(report)
+
+    return inventory
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--instances', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    inventory = generate_inventory(args.instances, args.seed)
+    print("Synthetic inventory: {} instances".format(len(inventory)))
+    print("{:<10} {:>12} {:>16} {:>16}".format('Account', 'compile (ms)', 'route (inst/s)', 'batch (inst/s)'))
+    for account_name, account in sorted(ACCOUNTS.items()):
+        start = perf_counter()
+        routing_table = compile_routing(account['routing'])
+        compile_time = perf_counter() - start
+
+        start = perf_counter()
+        recipients = [routing_table.route(report) for report in inventory]
+        route_time = perf_counter() - start
+
+        start = perf_counter()
+        batch_recipients = routing_table.route_batch(inventory)
+        batch_time = perf_counter() - start
+
+        assert recipients == batch_recipients
+        print("{:<10} {:>12.3f} {:>16,.0f} {:>16,.0f}".format(
+            account_name, compile_time * 1000, len(inventory) / route_time, len(inventory) / batch_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,431 @@
+"""
+Offline benchmark of the scan, run end to end through main() against a synthetic fleet without any network access.
+
+Usage:
+    python benchmarks/bench_scan.py [--fleet 4x1000x1 --fleet 16x2000x2] [--tag-coverage 0.7] [--throttle-rate 0.02]
+                                    [--runs 2] [--account STAMS] [--engine-args "--digest --lookahead-days 14"]
+                                    [--shared-code-rate 0.5 --check-steady-state]
+
+A fleet is REGIONSxINSTANCESxEVENTS: every region holds INSTANCES instances with EVENTS scheduled events each
+(a mix of event codes, deadlines and completed events), tagged with the values of the routing rules on about
+tag-coverage of the instances. The engine runs with real botocore clients whose HTTP requests are answered in
+process (requests still go through serialization, retries and parsing), MS teams posts are answered by a fake
+transport adapter. throttle-rate is the share of AWS requests answered with a throttling error. shared-code-rate is
+the share of instances whose events all have the same code (AWS Health maps network and power maintenance to the
+same system-maintenance code). The fake also stands in for the SQS queue of the AWS Health events (see
+bench_ingest.py).
+
+For every run of every fleet (later runs reuse the ledger, region catalog and change detection state of the
+first one): wall time, events per second, API requests by operation (throttled attempts included) and peak
+memory traced by tracemalloc are reported. With --check-steady-state, the runs after the first must not enrich
+any instance nor send any email (the fleet is unchanged), the benchmark fails otherwise.
+
+"""
+
+import argparse
+import json
+import os
+import random
+import shlex
+import shutil
+import sys
+import tempfile
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta, timezone
+from time import perf_counter, time
+from urllib.parse import unquote, urlparse
+
+import requests
+from botocore.awsrequest import AWSResponse
+from requests.adapters import HTTPAdapter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import ec2_scheduled_events as engine
+from bench_routing import get_rule_values
+from instrumentation import ApiMetrics
+
+# EC2 event descriptions, worded unlike the generic descriptions of the AWS Health collector
+EVENT_DESCRIPTIONS = {
+    'instance-stop': 'The instance is running on degraded hardware and will be stopped',
+    'instance-reboot': 'Scheduled reboot of the instance for maintenance',
+    'system-reboot': 'Scheduled reboot of the underlying host for maintenance',
+    'system-maintenance': 'Scheduled network maintenance of the underlying host',
+    'instance-retirement': 'The instance is running on degraded hardware and is scheduled for retirement'
+}
+REGIONS = ['us-east-1', 'us-east-2', 'us-west-1', 'us-west-2', 'ca-central-1', 'sa-east-1', 'eu-west-1', 'eu-west-2',
+           'eu-west-3', 'eu-central-1', 'eu-north-1', 'ap-south-1', 'ap-southeast-1', 'ap-southeast-2', 'ap-northeast-1',
+           'ap-northeast-2', 'ap-northeast-3']
+
+# Throttling answers per service: status and body
+THROTTLING_RESPONSES = {
+    'ec2': (400, b'<Response><Errors><Error><Code>RequestLimitExceeded</Code><Message>Request limit exceeded.</Message>'
+                 b'</Error></Errors><RequestID>bench</RequestID></Response>'),
+    'ses': (400, b'<ErrorResponse><Error><Type>Sender</Type><Code>Throttling</Code><Message>Maximum sending rate exceeded.'
+                 b'</Message></Error><RequestId>bench</RequestId></ErrorResponse>'),
+    's3': (503, b'<Error><Code>SlowDown</Code><Message>Please reduce your request rate.</Message></Error>')
+}
+# Services answered in JSON instead of XML
+JSON_SERVICES = ('sqs', 'health')
+# Services answered with a serialized body parsed by botocore (epoch timestamps like AWS Health), the other services
+# get their result filled in after-call
+SERIALIZED_SERVICES = ('health',)
+# AWS Health event type of each event code
+HEALTH_EVENT_TYPES = {
+    'instance-stop': 'AWS_EC2_INSTANCE_STOP_SCHEDULED',
+    'instance-reboot': 'AWS_EC2_INSTANCE_REBOOT_MAINTENANCE_SCHEDULED',
+    'system-reboot': 'AWS_EC2_SYSTEM_REBOOT_MAINTENANCE_SCHEDULED',
+    'system-maintenance': 'AWS_EC2_INSTANCE_NETWORK_MAINTENANCE_SCHEDULED',
+    'instance-retirement': 'AWS_EC2_INSTANCE_RETIREMENT_SCHEDULED'
+}
+# AWS account of the synthetic fleet
+ACCOUNT_ID = '123456789012'
+
+
+class RawBody(object):
+
+    def __init__(self, body):
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
+
+
+class FakeAws(object):
+
+    def __init__(self, regions, instances, events, tag_coverage=0.7, throttle_rate=0.0, ses_rate=1000.0, seed=1,
+                 shared_code_rate=0.0):
+        self.regions = REGIONS[:regions] if regions <= len(REGIONS) else \
+            REGIONS + ['xx-synthetic-{}'.format(index) for index in range(regions - len(REGIONS))]
+        self.throttle_rate = throttle_rate
+        self.ses_rate = ses_rate
+        self.statuses = {}
+        self.instances = {}
+        self.objects = set()
+        self.requests = Counter()
+        self.throttled = Counter()
+        self.emails = 0
+        self.active_events = 0
+        # SQS stand-in: queued (message ID, body), publish time of the queued events and their notification latency
+        self.queue = []
+        self.published = {}
+        self.published_ids = set()
+        self._health_events = None
+        self.latencies = []
+        self.queue_closed = False
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._queue_ready = threading.Condition(self._lock)
+        self._generate(instances, events, tag_coverage, shared_code_rate)
+
+    # Generates the instance statuses and instance details of every region
+    def _generate(self, instances, events, tag_coverage, shared_code_rate=0.0):
+
+        rng = self._rng
+        tag_values = get_rule_values()
+        now = datetime.now(timezone.utc)
+        for region_index, region in enumerate(self.regions):
+            statuses = []
+            for index in range(instances):
+                instance_id = 'i-{:04x}{:013x}'.format(region_index, index)
+                tags = [{'Key': 'Name', 'Value': 'server-{}-{}'.format(region, index)}]
+                tags.extend({'Key': tag, 'Value': rng.choice(values)} for tag, values in tag_values.items() if rng.random() < tag_coverage)
+                self.instances[instance_id] = {
+                    'InstanceId': instance_id,
+                    'Placement': {'AvailabilityZone': region + 'a'},
+                    'Tags': tags
+                }
+                instance_events = []
+                shared_code = rng.choice(sorted(EVENT_DESCRIPTIONS)) if shared_code_rate and rng.random() < shared_code_rate else None
+                for event_index in range(events):
+                    code = shared_code or rng.choice(sorted(EVENT_DESCRIPTIONS))
+                    description = EVENT_DESCRIPTIONS[code]
+                    if rng.random() < 0.1:
+                        description = '[Completed] ' + description
+                    else:
+                        self.active_events += 1
+                    instance_events.append({
+                        'InstanceEventId': 'instance-event-{:04x}{:09x}{:02x}'.format(region_index, index, event_index),
+                        'Code': code,
+                        'Description': description,
+                        'NotBefore': now + timedelta(days=rng.randint(1, 60), hours=rng.randint(0, 23))
+                    })
+                statuses.append({'InstanceId': instance_id, 'AvailabilityZone': region + 'a', 'Events': instance_events})
+            self.statuses[region] = statuses
+
+    # Session of an account, every request of its clients is answered by the fake
+    def create_session(self, *args, **kwargs):
+
+        session = engine.client_factory.create_session(credentials=('bench', 'bench'), region='us-east-1')
+        session.register('provide-client-params', self._provide_params)
+        session.register('before-send', self._before_send)
+        session.register('after-call', self._after_call)
+
+        return session
+
+    def _provide_params(self, params, context, **kwargs):
+        context['bench_params'] = dict(params)
+
+    # Answers the HTTP request: a throttling error, a missing S3 object or an empty result filled in after-call
+    def _before_send(self, request, event_name, **kwargs):
+
+        service, operation = event_name.split('.')[1:3]
+        service = service.lower()
+        with self._lock:
+            self.requests[(service, operation)] += 1
+            throttled = service in THROTTLING_RESPONSES and self.throttle_rate and self._rng.random() < self.throttle_rate
+            if throttled:
+                self.throttled[(service, operation)] += 1
+        if throttled:
+            status, body = THROTTLING_RESPONSES[service]
+            return AWSResponse(request.url, status, {}, RawBody(b'' if operation == 'HeadObject' else body))
+        if operation == 'HeadObject' and unquote(urlparse(request.url).path).lstrip('/').split('/', 1)[-1] not in self.objects:
+            return AWSResponse(request.url, 404, {}, RawBody(b''))
+
+        if service in SERIALIZED_SERVICES:
+            result = getattr(self, '_' + operation)(urlparse(request.url).hostname.split('.')[1], json.loads(request.body))
+            return AWSResponse(request.url, 200, {}, RawBody(json.dumps(result, default=lambda value: value.timestamp()).encode()))
+        if service in JSON_SERVICES:
+            return AWSResponse(request.url, 200, {}, RawBody(b'{}'))
+        return AWSResponse(request.url, 200, {}, RawBody('<Response><{}Result/></Response>'.format(operation).encode()))
+
+    def _after_call(self, http_response, parsed, model, context, **kwargs):
+
+        if http_response.status_code < 300 and model.service_model.service_name not in SERIALIZED_SERVICES:
+            handler = getattr(self, '_' + model.name, None)
+            if handler is not None:
+                parsed.update(handler(context.get('client_region'), context.get('bench_params', {})))
+
+    def _DescribeRegions(self, region, params):
+        return {'Regions': [{'RegionName': name, 'OptInStatus': 'opt-in-not-required'} for name in self.regions]}
+
+    def _DescribeInstanceStatus(self, region, params):
+
+        codes = set(next((item['Values'] for item in params.get('Filters', []) if item['Name'] == 'event.code'), EVENT_DESCRIPTIONS))
+        instance_ids = set(params.get('InstanceIds', ()))
+        with self._lock:
+            statuses = [dict(status, Events=[event for event in status['Events'] if event['Code'] in codes])
+                        for status in self.statuses.get(region, []) if not instance_ids or status['InstanceId'] in instance_ids]
+        statuses = [status for status in statuses if status['Events']]
+        start = int(params.get('NextToken', 0))
+        end = start + params.get('MaxResults', 1000)
+        result = {'InstanceStatuses': statuses[start:end]}
+        if end < len(statuses):
+            result['NextToken'] = str(end)
+
+        return result
+
+    def _DescribeInstances(self, region, params):
+
+        instance_ids = next((item['Values'] for item in params.get('Filters', []) if item['Name'] == 'instance-id'), None)
+        if instance_ids is None:
+            instance_ids = [status['InstanceId'] for status in self.statuses.get(region, [])[:params.get('MaxResults', 1000)]]
+        instances = [self.instances[instance_id] for instance_id in instance_ids if instance_id in self.instances]
+
+        return {'Reservations': [{'OwnerId': '123456789012', 'Instances': [instance]} for instance in instances]}
+
+    def _GetSendQuota(self, region, params):
+        return {'MaxSendRate': self.ses_rate, 'Max24HourSend': 1000000.0, 'SentLast24Hours': 0.0}
+
+    def _SendEmail(self, region, params):
+
+        body = params['Message']['Body']['Html']['Data']
+        with self._lock:
+            self.emails += 1
+            for instance_id in [instance_id for instance_id in self.published if instance_id in body]:
+                self.latencies.append(time() - self.published.pop(instance_id))
+        return {'MessageId': 'bench-{}'.format(self.emails)}
+
+    def _GetCallerIdentity(self, region, params):
+        return {'Account': ACCOUNT_ID, 'Arn': 'arn:aws:iam::{}:role/bench'.format(ACCOUNT_ID), 'UserId': 'bench'}
+
+    # Schedules a new event on the next instance of the region and queues its AWS Health event. The event code is one
+    # the instance has no event for, the S3 events tracker deduplicates events on their instance and description.
+    def publish_event(self, region):
+
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            status = next((status for status in self.statuses[region] if status['InstanceId'] not in self.published_ids and
+                           len(status['Events']) < len(EVENT_DESCRIPTIONS)), None)
+            if status is None:
+                return None
+            self.published_ids.add(status['InstanceId'])
+            self._health_events = None
+            code = min(set(EVENT_DESCRIPTIONS) - {event['Code'] for event in status['Events']})
+            status['Events'] = status['Events'] + [{
+                'InstanceEventId': 'instance-event-bench{:010x}'.format(len(self.published_ids)),
+                'Code': code,
+                'Description': EVENT_DESCRIPTIONS[code],
+                'NotBefore': now + timedelta(days=14)
+            }]
+            self.active_events += 1
+            self.published[status['InstanceId']] = time()
+            self.queue.append(('bench-{}'.format(status['InstanceId']), json.dumps({
+                'version': '0', 'id': status['InstanceId'], 'detail-type': 'AWS Health Event', 'source': 'aws.health',
+                'account': ACCOUNT_ID, 'time': now.isoformat(), 'region': region, 'resources': [status['InstanceId']],
+                'detail': {'service': 'EC2', 'eventTypeCode': 'AWS_EC2_INSTANCE_RETIREMENT_SCHEDULED',
+                           'eventTypeCategory': 'scheduledChange', 'affectedEntities': [{'entityValue': status['InstanceId']}]}
+            })))
+            self._queue_ready.notify_all()
+
+        return status['InstanceId']
+
+    # Wakes up the pending long polls, the queue answers right away from then on
+    def close_queue(self):
+
+        with self._lock:
+            self.queue_closed = True
+            self._queue_ready.notify_all()
+
+    # Long poll: waits for a message up to the wait time. Received messages stay invisible until deleted.
+    def _ReceiveMessage(self, region, params):
+
+        with self._lock:
+            self._queue_ready.wait_for(lambda: self.queue or self.queue_closed, params.get('WaitTimeSeconds', 0))
+            messages = self.queue[:params.get('MaxNumberOfMessages', 1)]
+            del self.queue[:len(messages)]
+
+        return {'Messages': [{'MessageId': message_id, 'ReceiptHandle': message_id, 'Body': body} for message_id, body in messages]}
+
+    # AWS Health organizational view: one event per active instance event, built once per fleet
+    def _get_health_events(self):
+
+        with self._lock:
+            if self._health_events is None:
+                self._health_events = [{
+                    'arn': 'arn:aws:health:{}::event/EC2/{}/{}'.format(region, HEALTH_EVENT_TYPES[event['Code']], event['InstanceEventId']),
+                    'region': region, 'eventTypeCode': HEALTH_EVENT_TYPES[event['Code']], 'startTime': event['NotBefore'],
+                    'instanceId': status['InstanceId']}
+                    for region, statuses in self.statuses.items() for status in statuses for event in status['Events']
+                    if not event['Description'].startswith('[')]
+            return self._health_events
+
+    def _DescribeEventsForOrganization(self, region, params):
+
+        events = self._get_health_events()
+        start = int(params.get('nextToken', 0))
+        end = start + params.get('maxResults', 100)
+        result = {'events': [{'arn': event['arn'], 'service': 'EC2', 'eventTypeCode': event['eventTypeCode'],
+                              'eventTypeCategory': 'scheduledChange', 'region': event['region'], 'startTime': event['startTime'],
+                              'statusCode': 'upcoming'} for event in events[start:end]]}
+        if end < len(events):
+            result['nextToken'] = '{:08d}'.format(end)
+
+        return result
+
+    def _DescribeAffectedEntitiesForOrganization(self, region, params):
+
+        event_arns = set(item['eventArn'] for item in params['organizationEntityAccountFilters'])
+        return {'entities': [{'eventArn': event['arn'], 'entityValue': event['instanceId'], 'awsAccountId': ACCOUNT_ID,
+                              'statusCode': 'PENDING'} for event in self._get_health_events() if event['arn'] in event_arns],
+                'failedSet': []}
+
+    def _DeleteMessageBatch(self, region, params):
+        return {'Successful': [{'Id': entry['Id']} for entry in params['Entries']], 'Failed': []}
+
+    def _ListObjectsV2(self, region, params):
+
+        keys = sorted(key for key in self.objects if key.startswith(params.get('Prefix', '')))
+        start = int(params.get('ContinuationToken', 0))
+        end = start + params.get('MaxKeys', 1000)
+        result = {'Contents': [{'Key': key} for key in keys[start:end]], 'IsTruncated': end < len(keys)}
+        if end < len(keys):
+            result['NextContinuationToken'] = str(end)
+
+        return result
+
+    def _PutObject(self, region, params):
+
+        with self._lock:
+            self.objects.add(params['Key'])
+        return {}
+
+
+# Fake MS teams transport, every webhook post succeeds
+def send_teams_post(adapter, request, **kwargs):
+
+    response = requests.Response()
+    response.status_code = 200
+    response.url = request.url
+    response.request = request
+    response._content = b'1'
+
+    return response
+
+
+# Function to parse a REGIONSxINSTANCESxEVENTS fleet
+def parse_fleet(fleet):
+
+    regions, instances, events = (int(value) for value in fleet.lower().split('x'))
+    return regions, instances, events
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fleet', action='append', type=parse_fleet,
+                        help='REGIONSxINSTANCESxEVENTS, can be repeated (default: 4x500x1, 8x2000x1, 16x2000x2)')
+    parser.add_argument('--tag-coverage', type=float, default=0.7)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--ses-rate', type=float, default=1000.0, help='SES maximum send rate returned by get_send_quota')
+    parser.add_argument('--runs', type=int, default=2)
+    parser.add_argument('--account', default='STAMS')
+    parser.add_argument('--engine-args', default='', help='extra arguments of ec2_scheduled_events.py')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--shared-code-rate', type=float, default=0.0,
+                        help='share of instances whose events all have the same event code')
+    parser.add_argument('--check-steady-state', action='store_true',
+                        help='fail when a run after the first enriches instances or sends emails')
+    args = parser.parse_args()
+    steady_state_errors = []
+    fleets = args.fleet or [(4, 500, 1), (8, 2000, 1), (16, 2000, 2)]
+
+    HTTPAdapter.send = send_teams_post
+    work_dir = tempfile.mkdtemp(prefix='bench_scan_')
+    start_dir = os.getcwd()
+    print("{:<12} {:>4} {:>9} {:>8} {:>11} {:>9} {:>10} {:>7} {:>10}".format(
+        'Fleet', 'Run', 'wall (s)', 'events', 'events/s', 'requests', 'throttled', 'emails', 'peak (MB)'))
+    try:
+        for regions, instances, events in fleets:
+            fleet_dir = os.path.join(work_dir, '{}x{}x{}'.format(regions, instances, events))
+            os.makedirs(fleet_dir)
+            os.chdir(fleet_dir)
+            fake = FakeAws(regions, instances, events, args.tag_coverage, args.throttle_rate, args.ses_rate, args.seed,
+                           args.shared_code_rate)
+            engine.create_account_session = fake.create_session
+            for run in range(1, args.runs + 1):
+                fake.requests.clear()
+                fake.throttled.clear()
+                fake.emails = 0
+                engine.api_metrics = ApiMetrics()
+                tracemalloc.start()
+                start = perf_counter()
+                with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+                    engine.main(['--account', args.account] + shlex.split(args.engine_args))
+                wall = perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+                print("{:<12} {:>4} {:>9.2f} {:>8} {:>11,.0f} {:>9} {:>10} {:>7} {:>10.1f}".format(
+                    '{}x{}x{}'.format(regions, instances, events), run, wall, fake.active_events, fake.active_events / wall,
+                    sum(fake.requests.values()), sum(fake.throttled.values()), fake.emails, peak / 1024.0 / 1024.0))
+                for (service, operation), count in sorted(fake.requests.items()):
+                    print("{:<17} {}.{}: {} ({} throttled)".format('', service, operation, count, fake.throttled[(service, operation)]))
+                if run > 1 and (fake.requests[('ec2', 'DescribeInstances')] or fake.emails):
+                    steady_state_errors.append("{}x{}x{} run {}: {} describe_instances calls, {} emails".format(
+                        regions, instances, events, run, fake.requests[('ec2', 'DescribeInstances')], fake.emails))
+    finally:
+        os.chdir(start_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.check_steady_state:
+        if steady_state_errors:
+            sys.exit("Steady state not reached:\n    " + "\n    ".join(steady_state_errors))
+        print("Steady state: no enrichment and no email after the first run.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Offline check of the API call instrumentation on calls failing without a response.
+
+Usage:
+    python benchmarks/check_instrumentation.py [--endpoint-url http://127.0.0.1:9]
+
+An instrumented EC2 client pointed at an unreachable endpoint makes a single attempt: the call must fail with the
+botocore connection error (not an error of the instrumentation hooks) and be recorded as a failed call.
+
+"""
+
+import argparse
+import os
+import sys
+
+from botocore.exceptions import EndpointConnectionError
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from client_factory import ClientFactory
+from instrumentation import ApiMetrics
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--endpoint-url', default='http://127.0.0.1:9', help='endpoint refusing connections')
+    args = parser.parse_args()
+
+    metrics = ApiMetrics()
+    factory = ClientFactory(max_attempts=1)
+    session = factory.create_session(credentials=('check', 'check'))
+    metrics.register(session, 'CHECK')
+    client = factory.get_client(session, 'ec2', 'us-east-1', endpoint_url=args.endpoint_url)
+
+    try:
+        client.describe_regions()
+    except EndpointConnectionError as e:
+        print("Connection error raised: {}".format(e))
+    else:
+        sys.exit("describe_regions succeeded, {} is reachable".format(args.endpoint_url))
+
+    stats = metrics.stats.get(('CHECK', 'us-east-1', 'ec2', 'DescribeRegions'))
+    if stats is None or stats['calls'] != 1 or stats['errors'] != 1:
+        sys.exit("Failed call not recorded: {}".format(metrics.stats))
+    for line in metrics.summary():
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
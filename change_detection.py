@@ -0,0 +1,210 @@
+"""
+Event change detection for the EC2 scheduled events notification engine.
+
+Each run's scheduled events are diffed against the previous run. Events of a scan are matched on their
+InstanceEventId. AWS Health events carry no event ID: they are matched on their instance, event code and deadline,
+and an event whose deadline moved on the only row of its instance and code not matched otherwise (the same fallback
+matches the rows written by the other source, a scan event adopts the event ID of the row). Events are classified as:
+
+    new             not seen on the previous run
+    rescheduled     seen before with another deadline (NotBefore)
+    unchanged       seen before with the same deadline, skipped before any enrichment or notification
+    cleared         seen before but no longer listed (completed, canceled or gone) in a region scanned successfully
+
+The previous events and their reports are kept in a SQLite table (by default in the notification ledger database),
+so cleared events can be notified without any extra API call. The state of earlier versions is moved to the table
+when the database is opened.
+
+"""
+
+import sqlite3
+import threading
+
+from scheduled_event import ScheduledEvent
+
+NEW = 'New'
+RESCHEDULED = 'Rescheduled'
+UNCHANGED = 'Unchanged'
+CLEARED = 'Cleared'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS scheduled_event_state (
+    account TEXT NOT NULL,
+    event_id TEXT,
+    instance_id TEXT NOT NULL,
+    event_code TEXT NOT NULL,
+    region TEXT NOT NULL,
+    not_before TEXT NOT NULL,
+    report TEXT,
+    seen_run INTEGER NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS scheduled_event_state_event ON scheduled_event_state (account, event_id)
+    WHERE event_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS scheduled_event_state_instance ON scheduled_event_state (account, instance_id, event_code);
+CREATE INDEX IF NOT EXISTS scheduled_event_state_region ON scheduled_event_state (account, region, seen_run);
+CREATE TABLE IF NOT EXISTS event_state_runs (
+    account TEXT PRIMARY KEY,
+    run INTEGER NOT NULL
+);
+'''
+
+# State tables of earlier versions, moved to scheduled_event_state: the InstanceEventId keyed table (keyed on the
+# instance ID for AWS Health events) and the instance and event code keyed table
+MIGRATIONS = {
+    'event_state': '''
+INSERT OR IGNORE INTO scheduled_event_state (account, event_id, instance_id, event_code, region, not_before, report, seen_run)
+    SELECT account, CASE WHEN event_id = instance_id THEN NULL ELSE event_id END, instance_id, event_code, region, not_before,
+           report, seen_run FROM event_state;
+DROP TABLE event_state;
+''',
+    'instance_event_state': '''
+INSERT INTO scheduled_event_state (account, event_id, instance_id, event_code, region, not_before, report, seen_run)
+    SELECT account, NULL, instance_id, event_code, region, not_before, report, seen_run FROM instance_event_state;
+DROP TABLE instance_event_state;
+'''
+}
+
+
+# Function to get the change detection key (InstanceEventId, None for AWS Health events, instance ID, event code,
+# NotBefore) of an instance status
+def get_event_key(instances):
+
+    event = instances['Events'][0]
+    return event.get('InstanceEventId'), instances['InstanceId'], event['Code'], str(event['NotBefore'])
+
+
+class ChangeDetector(object):
+
+    def __init__(self, path='notifications.db'):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+        for table, migration in sorted(MIGRATIONS.items()):
+            if self._conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone():
+                self._conn.executescript('BEGIN IMMEDIATE;' + migration + 'COMMIT;')
+        self.runs = {}
+        self.stats = {}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # Starts a new run for the account, events not marked during the run are cleared when the run is finished
+    def start_run(self, account):
+
+        with self._lock:
+            row = self._conn.execute('SELECT run FROM event_state_runs WHERE account = ?', (account,)).fetchone()
+            run = (row[0] if row else 0) + 1
+            self._conn.execute('INSERT OR REPLACE INTO event_state_runs (account, run) VALUES (?, ?)', (account, run))
+            self.runs[account] = run
+            self.stats[account] = {NEW: 0, RESCHEDULED: 0, UNCHANGED: 0, CLEARED: 0}
+
+    # Finds the stored row (rowid, NotBefore) of an event, None when it has none. An exact match is on the event ID, or
+    # on the instance, code and deadline among the rows without event ID (all the rows for an AWS Health event). Otherwise
+    # the only candidate row of the instance and code not matched yet is taken, its deadline moved.
+    def _match(self, account, instances, matched, exact):
+
+        event_id, instance_id, event_code, not_before = get_event_key(instances)
+        if exact and event_id is not None:
+            row = self._conn.execute('SELECT rowid, not_before FROM scheduled_event_state WHERE account = ? AND event_id = ?',
+                                     (account, event_id)).fetchone()
+            if row is not None:
+                return row
+
+        query = 'SELECT rowid, not_before FROM scheduled_event_state WHERE account = ? AND instance_id = ? AND event_code = ?'
+        params = [account, instance_id, event_code]
+        if event_id is not None:
+            query += ' AND event_id IS NULL'
+        if exact:
+            query += ' AND not_before = ?'
+            params.append(not_before)
+        rows = [row for row in self._conn.execute(query, params).fetchall() if row[0] not in matched]
+        if exact or len(rows) == 1:
+            return rows[0] if rows else None
+        return None
+
+    # Classifies the scheduled events of a page. Returns (instances, change, previous deadline, state ID) for the events
+    # needing work, unchanged events are marked as seen and left out. New and rescheduled events are only recorded
+    # through store_report once handled, so an event whose handling failed is classified the same way on the next run.
+    # Every event of an instance is in the same page: exact matches are made first so the fallback on the instance and
+    # code only sees the rows left.
+    def classify(self, account, region, instance_statuses):
+
+        run = self.runs[account]
+        rows = [None] * len(instance_statuses)
+        matched = set()
+        changed = []
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            for exact in (True, False):
+                for index, instances in enumerate(instance_statuses):
+                    if rows[index] is None:
+                        rows[index] = self._match(account, instances, matched, exact)
+                        if rows[index] is not None:
+                            matched.add(rows[index][0])
+            for instances, row in zip(instance_statuses, rows):
+                event_id, instance_id, event_code, not_before = get_event_key(instances)
+                if row is None:
+                    change, previous_deadline, state_id = NEW, None, None
+                else:
+                    state_id, previous_deadline = row
+                    change = UNCHANGED if previous_deadline == not_before else RESCHEDULED
+                    # A row written from AWS Health takes the event ID of the scan
+                    self._conn.execute('UPDATE scheduled_event_state SET seen_run = ?, event_id = COALESCE(event_id, ?) '
+                                       'WHERE rowid = ?', (run, event_id, state_id))
+                self.stats[account][change] += 1
+                if change != UNCHANGED:
+                    changed.append((instances, change, previous_deadline, state_id))
+            self._conn.execute('COMMIT')
+
+        return changed
+
+    # Records a handled new or rescheduled event with its report, used to notify it once cleared
+    def store_report(self, account, region, instances, report):
+
+        event_id, instance_id, event_code, not_before = get_event_key(instances)
+        state_id = instances.get('StateId')
+        with self._lock:
+            if state_id is None:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO scheduled_event_state '
+                    '(account, event_id, instance_id, event_code, region, not_before, report, seen_run) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (account, event_id, instance_id, event_code, region, not_before, report.to_json(), self.runs[account]))
+            else:
+                self._conn.execute('UPDATE scheduled_event_state SET region = ?, not_before = ?, report = ?, seen_run = ? WHERE rowid = ?',
+                                   (region, not_before, report.to_json(), self.runs[account], state_id))
+
+    # Reverts the record of an event whose notification failed: a new event is forgotten, a rescheduled one goes back to
+    # its previous deadline, so the next run classifies it the same way again
+    def revert(self, account, report):
+
+        row = 'SELECT rowid FROM scheduled_event_state WHERE account = ? AND instance_id = ? AND event_code = ? AND not_before = ? LIMIT 1'
+        key = (account, report.instance_id, report.code, report.deadline)
+        with self._lock:
+            if report.change == RESCHEDULED and report.previous_deadline is not None:
+                self._conn.execute('UPDATE scheduled_event_state SET not_before = ? WHERE rowid IN ({})'.format(row),
+                                   (report.previous_deadline,) + key)
+            else:
+                self._conn.execute('DELETE FROM scheduled_event_state WHERE rowid IN ({})'.format(row), key)
+
+    # Finishes the run: returns the reports of the events cleared in the given (successfully scanned) regions and
+    # forgets them. Events without a stored report (never notified) are forgotten silently.
+    def finish_run(self, account, regions):
+
+        run = self.runs[account]
+        cleared = []
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            for region in regions:
+                rows = self._conn.execute('SELECT report FROM scheduled_event_state WHERE account = ? AND region = ? AND seen_run != ?',
+                                          (account, region, run)).fetchall()
+                for report, in rows:
+                    if report:
+                        cleared.append(ScheduledEvent.from_json(report))
+                self._conn.execute('DELETE FROM scheduled_event_state WHERE account = ? AND region = ? AND seen_run != ?',
+                                   (account, region, run))
+            self._conn.execute('COMMIT')
+            self.stats[account][CLEARED] = len(cleared)
+
+        return cleared
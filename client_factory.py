@@ -0,0 +1,75 @@
+"""
+Client factory of the EC2 scheduled events notification engine.
+
+Sessions are plain botocore sessions, one per account: boto3 brings nothing the engine uses and importing it costs
+more than creating every client of a run. All the sessions share the data loader of the first one, so the service
+models and endpoint rules are read and parsed once per process instead of once per account.
+
+Clients are cached per session, service, region and endpoint, shared by every thread and created with a connection
+pool sized for the workers sharing them (the default pool of 10 connections is smaller than the S3 tracker upload
+pool). The time spent creating clients is recorded per service.
+
+"""
+
+import threading
+import weakref
+from time import perf_counter
+
+import botocore.session
+from botocore.config import Config
+
+
+class ClientFactory(object):
+
+    def __init__(self, max_attempts=10, max_pool_connections=16):
+        # Throttled and failed calls are retried by botocore with jittered exponential backoff and client side rate limiting
+        self.config = Config(retries={'mode': 'adaptive', 'total_max_attempts': max_attempts},
+                             max_pool_connections=max_pool_connections)
+        self.stats = {}
+        self._loader = None
+        self._clients = weakref.WeakKeyDictionary()
+        # Creating clients from a session is not thread safe, client creation is serialized through this lock
+        self._lock = threading.Lock()
+
+    # Creates a session (profile, static credentials or default credential chain) sharing the factory data loader
+    def create_session(self, profile=None, credentials=None, region=None):
+
+        session = botocore.session.Session(profile=profile)
+        with self._lock:
+            if self._loader is None:
+                self._loader = session.get_component('data_loader')
+            else:
+                session.register_component('data_loader', self._loader)
+        if credentials is not None:
+            session.set_credentials(*credentials)
+        if region is not None:
+            session.set_config_variable('region', region)
+
+        return session
+
+    # Gets the client of a session for a service and region, created on first use
+    def get_client(self, session, service, region=None, endpoint_url=None):
+
+        with self._lock:
+            clients = self._clients.setdefault(session, {})
+            client = clients.get((service, region, endpoint_url))
+            if client is None:
+                start = perf_counter()
+                client = clients[(service, region, endpoint_url)] = session.create_client(
+                    service, region_name=region, endpoint_url=endpoint_url, config=self.config)
+                elapsed = perf_counter() - start
+                stats = self.stats.setdefault(service, {'clients': 0, 'time': 0.0, 'max': 0.0})
+                stats['clients'] += 1
+                stats['time'] += elapsed
+                stats['max'] = max(stats['max'], elapsed)
+
+        return client
+
+    # Summary lines of the clients created per service
+    def summary(self):
+
+        with self._lock:
+            stats = sorted(self.stats.items())
+        return ["Clients {:<8} {:>4} created in {:.3f}s ({:.1f} ms average, {:.1f} ms max)".format(
+                    service, values['clients'], values['time'], values['time'] * 1000 / values['clients'], values['max'] * 1000)
+                for service, values in stats]
@@ -0,0 +1,72 @@
+"""
+Notification dispatch pipeline for the EC2 scheduled events notification engine.
+
+The scan produces notification jobs onto a bounded queue per sink (ledger, SES, MS teams), each sink being served by
+its own pool of dispatch workers. A full queue blocks the producer (backpressure) and a failed job is counted and
+logged without stopping the other jobs, its arguments are kept in failures for the caller to tell what was not
+delivered. drain() waits for the queued jobs of the given sinks to complete and stops
+their workers.
+
+"""
+
+import logging
+import threading
+from queue import Queue
+
+
+class Dispatcher(object):
+
+    def __init__(self, sinks, queue_size=1000, logger=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.queues = {}
+        self.workers = {}
+        self.stats = {}
+        self.failures = {}
+        self._lock = threading.Lock()
+        for sink, concurrency in sinks.items():
+            self.queues[sink] = Queue(maxsize=queue_size)
+            self.stats[sink] = {'done': 0, 'failed': 0, 'max_depth': 0}
+            self.failures[sink] = []
+            self.workers[sink] = [threading.Thread(target=self._work, args=(sink,), name='{}-{}'.format(sink, index))
+                                  for index in range(concurrency)]
+            for worker in self.workers[sink]:
+                worker.daemon = True
+                worker.start()
+
+    # Queues a job on a sink, blocks while the sink queue is full
+    def submit(self, sink, func, *args):
+
+        self.queues[sink].put((func, args))
+        depth = self.queues[sink].qsize()
+        with self._lock:
+            if depth > self.stats[sink]['max_depth']:
+                self.stats[sink]['max_depth'] = depth
+
+    def _work(self, sink):
+
+        while True:
+            job = self.queues[sink].get()
+            if job is None:
+                break
+            func, args = job
+            try:
+                func(*args)
+                failed = False
+            except Exception as e:
+                failed = True
+                print("Dispatch to {} failed: {}".format(sink, e))
+                self.logger.info("Dispatch to {} failed: {}".format(sink, e))
+            with self._lock:
+                self.stats[sink]['failed' if failed else 'done'] += 1
+                if failed:
+                    self.failures[sink].append(args)
+
+    # Waits for every queued job of the sinks (in the given order) and stops their workers
+    def drain(self, sinks=None):
+
+        for sink in sinks or list(self.workers):
+            for _ in self.workers[sink]:
+                self.queues[sink].put(None)
+            for worker in self.workers[sink]:
+                worker.join()
+            self.workers[sink] = []
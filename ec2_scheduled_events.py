@@ -0,0 +1,1012 @@
+"""
+author: adrilon
+version: 3.0
+
+This script will pull all AWS scheduled EC2 events in every account configured in accounts.py and notify it's
+respective application owner group. Accounts are scanned concurrently within a single process, each account
+scanning its regions with a bounded worker pool.
+
+Usage:
+    python ec2_scheduled_events.py                        # scan every configured account
+    python ec2_scheduled_events.py --account STAMS        # scan the listed account(s) only
+    python ec2_scheduled_events.py --daemon --interval 300  # rescan every 5 minutes until SIGTERM
+
+Note:
+    In daemon mode the account sessions, their regional clients and HTTP pools, the region catalog, the notification
+    ledger and the MS teams session are kept in memory between cycles. SIGTERM (or Ctrl-C) stops the daemon once the
+    current cycle is over.
+
+    Each account is reached through the profile or role ARN set in accounts.py. Use --use-default-credentials to
+    scan a single account with whatever default profile is set in your STS credential retrieval tool.
+
+"""
+
+from time import perf_counter, time
+
+# Start of the imports, the startup time is reported by --profile
+_import_start = perf_counter()
+
+import argparse
+import signal
+import threading
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse
+import logging
+
+import region_catalog
+from accounts import ACCOUNTS
+from change_detection import CLEARED, RESCHEDULED, ChangeDetector
+from client_factory import ClientFactory
+from dispatch import Dispatcher
+from event_queue import EventQueue, get_affected_instances
+from event_tracker import EventTracker
+from health_collector import HealthCollector
+from instrumentation import ApiMetrics
+from ledger import NotificationLedger
+from profiling import ThreadProfiler, stage_timer
+from render import render_email
+from routing import compile_routing
+from scheduled_event import ScheduledEvent
+from ses_governor import SesRateGovernor
+from teams import TeamsSender
+
+_import_time = perf_counter() - _import_start
+
+# S3 bucket holding the events tracker, shared by all accounts
+TRACKER_BUCKET = 'infor-sthybrid-infrashared-us-east-1'
+TRACKER_PREFIX = 'ssm/aws-scheduled-events/'
+EMAIL_SOURCE = 'noreply-cloudnotification@infor.com'
+
+# Codes of the scheduled events notified
+EVENT_CODES = ['instance-stop', 'instance-reboot', 'system-reboot', 'system-maintenance', 'instance-retirement']
+# describe_instance_status accepts up to 100 instance IDs per call
+INSTANCE_IDS_PER_CALL = 100
+
+# Descriptions of the scheduled events once they are over
+CLOSED_EVENT_PREFIXES = ('[Completed]', '[Canceled]')
+
+# Assumed role credentials last 1 hour, sessions built on them are created again before they expire
+ROLE_SESSION_TTL = 50 * 60
+
+# Sessions and cached clients of every account, replaced in main() with the retry and connection pool settings
+client_factory = ClientFactory()
+# Account sessions kept for the whole process (daemon cycles): account name -> (session, expiry time or None)
+_account_sessions = {}
+# Calls, latency, retries and throttles per account, region and operation, filled by the session event hooks
+api_metrics = ApiMetrics()
+# Traffic recorder (--record) and fixture replayer (--replay) of the run
+recorder = None
+replayer = None
+# File handlers are shared between accounts logging to the same file
+_file_handlers = {}
+
+
+# Function to setup the summary logger of an account
+def get_account_logger(account_name, log_file):
+
+    logger = logging.getLogger('{}.{}'.format(__name__, account_name))
+    logger.setLevel(logging.INFO)
+    if not logger.handlers:
+        if log_file not in _file_handlers:
+            formatter = logging.Formatter('%(asctime)s:%(levelname)s:%(name)s:%(message)s')
+            file_handler = logging.FileHandler(log_file)
+            file_handler.setFormatter(formatter)
+            _file_handlers[log_file] = file_handler
+        logger.addHandler(_file_handlers[log_file])
+
+    return logger
+
+
+# Function to create the session of an account (profile and/or assumed role)
+def create_account_session(account, use_default_credentials=False):
+
+    if use_default_credentials:
+        return client_factory.create_session()
+
+    session = client_factory.create_session(profile=account.get('profile'))
+    if account.get('role_arn'):
+        credentials = create_client(session, 'sts').assume_role(
+            RoleArn=account['role_arn'],
+            RoleSessionName='aws-scheduled-events'
+        )['Credentials']
+        session = client_factory.create_session(
+            credentials=(credentials['AccessKeyId'], credentials['SecretAccessKey'], credentials['SessionToken'])
+        )
+
+    return session
+
+
+# Function to get the session of an account, created (and instrumented) once and kept until its credentials expire
+def get_account_session(account_name, account, use_default_credentials=False):
+
+    session, expires_at = _account_sessions.get(account_name, (None, None))
+    if session is not None and (expires_at is None or time() < expires_at):
+        return session
+
+    if replayer is not None:
+        session, expires_at = client_factory.create_session(credentials=('replay', 'replay'), region='us-east-1'), None
+        replayer.register(session, account_name)
+    else:
+        session = create_account_session(account, use_default_credentials)
+        expires_at = time() + ROLE_SESSION_TTL if account.get('role_arn') and not use_default_credentials else None
+    # Every client of the account is instrumented (and recorded) through its session
+    api_metrics.register(session, account_name)
+    if recorder is not None:
+        recorder.register(session, account_name)
+    _account_sessions[account_name] = (session, expires_at)
+
+    return session
+
+
+# Function to get the client of a session for a service and region, created once and shared between threads
+def create_client(session, service, region=None, endpoint_url=None):
+    return client_factory.get_client(session, service, region, endpoint_url)
+
+
+# Function to get the region of an SQS queue URL (https://sqs.<region>.amazonaws.com/<account>/<name>), us-east-1 for
+# any other URL (local SQS stand-ins)
+def get_queue_region(queue_url):
+
+    host = urlparse(queue_url).hostname or ''
+    parts = host.split('.')
+    return parts[1] if len(parts) > 3 and parts[0] == 'sqs' else 'us-east-1'
+
+
+# Function to split instance statuses into one status per active event, events over (completed or canceled) are dropped
+def get_active_events(instance_statuses):
+
+    active_events = []
+    for instances in instance_statuses:
+        for event in instances.get('Events', []):
+            if not event['Description'].startswith(CLOSED_EVENT_PREFIXES):
+                active_events.append(dict(instances, Events=[event]))
+
+    return active_events
+
+
+# Function to get all AWS scheduled events with the following filtered values, yielded page by page
+def get_ec2_scheduled_events(client, max_results=1000):
+
+    paginator = client.get_paginator('describe_instance_status')
+    pages = paginator.paginate(
+        Filters=[
+            {
+                'Name': 'event.code',
+                'Values': EVENT_CODES
+            }
+        ],
+        PaginationConfig={'PageSize': max_results}
+    )
+    pages = iter(pages)
+    while True:
+        # Pages are fetched by the paginator as they are iterated
+        with stage_timer.span('status scan'):
+            page = next(pages, None)
+        if page is None:
+            return
+        yield page['InstanceStatuses']
+
+
+# Function to get the scheduled events of the given instances, instances gone since their event was published are skipped
+def describe_instance_events(client, instance_ids):
+
+    instance_statuses = []
+    for start in range(0, len(instance_ids), INSTANCE_IDS_PER_CALL):
+        chunk = instance_ids[start:start + INSTANCE_IDS_PER_CALL]
+        try:
+            instance_statuses.extend(client.describe_instance_status(
+                InstanceIds=chunk,
+                Filters=[{'Name': 'event.code', 'Values': EVENT_CODES}]
+            )['InstanceStatuses'])
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'InvalidInstanceID.NotFound':
+                raise
+            # One unknown instance fails the whole call, the instances are then looked up one by one
+            if len(chunk) > 1:
+                for instance_id in chunk:
+                    instance_statuses.extend(describe_instance_events(client, [instance_id]))
+
+    return instance_statuses
+
+
+# Function to resolve instance details (AZ, OwnerId, tags) for a list of instance IDs in batched calls
+def describe_instances_batch(client, instance_ids, chunk_size=200):
+
+    instance_details = {}
+    api_calls = 0
+    paginator = client.get_paginator('describe_instances')
+    # The instance-id filter accepts up to 200 values per call
+    for start in range(0, len(instance_ids), chunk_size):
+        chunk = instance_ids[start:start + chunk_size]
+        for page in paginator.paginate(Filters=[{'Name': 'instance-id', 'Values': chunk}]):
+            api_calls += 1
+            for reservation in page['Reservations']:
+                for instance in reservation['Instances']:
+                    instance_details[instance['InstanceId']] = {
+                        'AvailabilityZone': instance['Placement']['AvailabilityZone'],
+                        'OwnerId': reservation['OwnerId'],
+                        'Tags': instance.get('Tags', [])
+                    }
+
+    return instance_details, api_calls
+
+
+# Function to give events collected from AWS Health the description EC2 has for them, matched on the instance, code and
+# deadline (or the only active event of the instance with that code). Events EC2 no longer lists keep their generic
+# description.
+def set_ec2_descriptions(client, instance_statuses):
+
+    ec2_events = {}
+    instance_ids = list(dict.fromkeys(instances['InstanceId'] for instances in instance_statuses))
+    for instances in get_active_events(describe_instance_events(client, instance_ids)):
+        event = instances['Events'][0]
+        ec2_events.setdefault((instances['InstanceId'], event['Code']), []).append(event)
+
+    for instances in instance_statuses:
+        event = instances['Events'][0]
+        candidates = ec2_events.get((instances['InstanceId'], event['Code']), [])
+        matches = [candidate for candidate in candidates if candidate['NotBefore'] == event['NotBefore']] or \
+            (candidates if len(candidates) == 1 else [])
+        if matches:
+            instances['Events'] = [dict(event, Description=matches[0]['Description'])]
+
+
+# Function to handle a page of instance statuses: its active events go through filter_page and the lookahead window,
+# then the remaining instances are enriched at once and handed to handle_page. Returns the page counters
+# (events listed, events changed, instances described, describe_instances calls). With lookup_descriptions (events
+# collected from AWS Health), the EC2 descriptions of the remaining events are looked up first: the S3 events tracker
+# names events after their description.
+def process_page(ec2_conn, region, page_statuses, handle_page, filter_page=None, deadline=None, lookup_descriptions=False):
+
+    instance_statuses = get_active_events(page_statuses)
+    listed_events = len(instance_statuses)
+    if filter_page is not None:
+        with stage_timer.span('change detection'):
+            instance_statuses = filter_page(region, instance_statuses)
+    # Events past the lookahead window are still seen by filter_page so they are never taken for cleared
+    if deadline is not None:
+        instance_statuses = [instances for instances in instance_statuses if instances['Events'][0]['NotBefore'] <= deadline]
+    if lookup_descriptions and instance_statuses:
+        with stage_timer.span('description lookup'):
+            set_ec2_descriptions(ec2_conn, instance_statuses)
+
+    # Enrich every flagged instance of the page at once instead of one describe_instances call per event
+    instance_ids = list(dict.fromkeys(instances['InstanceId'] for instances in instance_statuses))
+    with stage_timer.span('instance enrichment'):
+        instance_details, api_calls = describe_instances_batch(ec2_conn, instance_ids)
+    handle_page(region, instance_statuses, instance_details)
+
+    return listed_events, len(instance_statuses), len(instance_ids), api_calls
+
+
+# Function to get the end of the lookahead window, None when every event is handled
+def get_lookahead_deadline(lookahead_days):
+    return datetime.now(timezone.utc) + timedelta(days=lookahead_days) if lookahead_days else None
+
+
+# Function to scan a single region for scheduled events, each page is enriched and handed to handle_page as it arrives.
+# Every active event of an instance is handled, events starting after the lookahead window are left to a later run and
+# filter_page drops the events needing no work (unchanged since the previous run) before any enrichment. The instance
+# statuses of the region can also be given (collected from AWS Health), they are then handled as a single page.
+def scan_region(session, region, handle_page, max_results=1000, filter_page=None, lookahead_days=None, collected=None):
+
+    start_time = time()
+    deadline = get_lookahead_deadline(lookahead_days)
+    region_result = {
+        'Region': region,
+        'Events': 0,
+        'ChangedEvents': 0,
+        'Pages': 0,
+        'InstancesDescribed': 0,
+        'DescribeCalls': 0
+    }
+    # A failed region is reported in the result without affecting the other regions
+    try:
+        ec2_conn = create_client(session, 'ec2', region)
+        pages = get_ec2_scheduled_events(ec2_conn, max_results) if collected is None else [collected]
+        for page_statuses in pages:
+            listed_events, changed_events, instances_described, api_calls = process_page(
+                ec2_conn, region, page_statuses, handle_page, filter_page, deadline, collected is not None)
+            region_result['Pages'] += 1
+            region_result['Events'] += listed_events
+            region_result['ChangedEvents'] += changed_events
+            region_result['InstancesDescribed'] += instances_described
+            region_result['DescribeCalls'] += api_calls
+
+        # A region without events is probed for instances, regions without any are pruned by the region catalog
+        if collected is None:
+            region_result['HasInstances'] = region_result['Events'] > 0 or \
+                len(ec2_conn.describe_instances(MaxResults=5)['Reservations']) > 0
+    except Exception as e:
+        region_result['Error'] = str(e)
+    region_result['Elapsed'] = time() - start_time
+
+    return region_result
+
+
+# Function to scan all regions with a bounded worker pool, results are returned in region order. With the instance
+# statuses collected from AWS Health ({region: [instance status]}), the regions are not scanned.
+def scan_regions(session, regions, handle_page, max_workers, max_results=1000, filter_page=None, lookahead_days=None,
+                 collected=None):
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        region_results = list(executor.map(lambda region: scan_region(
+            session, region, handle_page, max_results, filter_page, lookahead_days,
+            collected.get(region, []) if collected is not None else None), regions))
+
+    return region_results
+
+
+# Function to send the events notification email to the recipient DL, one table row per event sorted by deadline
+def send_email(ses_client, recipient, reports):
+
+    with stage_timer.span('rendering'):
+        subject, html_body, text_body = render_email(reports)
+    with stage_timer.span('SES send'):
+        response = ses_client.send_email(
+            Source=EMAIL_SOURCE,
+            Destination={
+                'ToAddresses': [
+                    '{}'.format(recipient),
+
+                ]
+            },
+            Message={
+                'Subject': {
+                    'Data': subject,
+                    'Charset': 'UTF-8'
+                },
+                'Body': {
+                    'Html': {
+                        'Charset': 'UTF-8',
+                        'Data': html_body
+                    },
+                    'Text': {
+                        'Charset': 'UTF-8',
+                        'Data': text_body
+                    }
+                }
+            }
+        )
+
+    return response
+
+
+# Function to get the S3 events tracker object name of an event
+def get_object_summary(report):
+
+    object_summary = report.instance_id + "_" + report.description
+    # A rescheduled event is notified again under its new deadline
+    if report.change == RESCHEDULED:
+        object_summary += "_" + report.deadline
+    return object_summary
+
+
+# Function to notify a new event once, run by the ledger dispatch workers: the event is claimed in the ledger then its
+# email and MS teams jobs are queued. In digest mode the event is added to the digest of its recipient instead of emailed.
+def notify_event(account_name, account, clients, ledger, dispatcher, logger, report, digest=None):
+
+    object_summary = get_object_summary(report)
+    # Claim the event in the notification ledger, it is uploaded to the S3 events tracker at the end of the run
+    if not ledger.claim(account_name, report.instance_id, report.code, report.deadline, object_summary,
+                        report.recipient, report.to_json()):
+        return
+    print("Event recorded - {} and has been sent to {}".format(object_summary, report.recipient))
+    logger.info("Event recorded - {} and has been sent to {}".format(object_summary, report.recipient))
+
+    # Sending email
+    if digest is not None:
+        digest.setdefault(report.recipient, []).append(report)
+    else:
+        dispatcher.submit('ses', send_email, clients['ses'], report.recipient, [report])
+    dispatcher.submit('teams', clients['teams'].add, account['chat_channel'], account['card_title'], report)
+
+
+# Function to get the notification clients of an account
+def get_account_clients(session, args, teams_sender):
+
+    return {
+        # SES calls are paced under the account's maximum send rate
+        'ses': SesRateGovernor(create_client(session, 'ses'), args.ses_headroom, paced=replayer is None),
+        's3': create_client(session, 's3'),
+        'teams': teams_sender
+    }
+
+
+# Function to get the page handlers of an account, shared by the region scans and the event queue ingestion:
+# filter_page diffs a page against the previous run, handle_page routes, deduplicates and notifies its events.
+def get_page_handlers(account_name, account, routing_table, clients, ledger, detector, tracker, head_fallback, dispatcher,
+                      logger, digest=None):
+
+    # Events are diffed against the previous run, unchanged events are dropped before any enrichment or notification
+    def filter_page(region, instance_statuses):
+        changed = []
+        for instances, change, previous_deadline, state_id in detector.classify(account_name, region, instance_statuses):
+            instances['Change'], instances['PreviousDeadline'], instances['StateId'] = change, previous_deadline, state_id
+            changed.append(instances)
+        return changed
+
+    # Handles a page of new or rescheduled events as soon as it has been enriched, called from the region workers (or the
+    # event queue consumer)
+    def handle_page(region, instance_statuses, instance_details):
+        reports = []
+        handled = []
+        for instances in instance_statuses:
+            # Instance details acquired through the batched describe instances
+            ec2_instance_details = instance_details.get(instances['InstanceId'])
+            if ec2_instance_details is None:
+                print("Instance {} is no longer available, skipping event.".format(instances['InstanceId']))
+                logger.info("Instance {} is no longer available, skipping event.".format(instances['InstanceId']))
+                continue
+
+            # A malformed event is reported and skipped without affecting the rest of the page
+            try:
+                with stage_timer.span('tag parsing'):
+                    report = ScheduledEvent.from_instance(instances, ec2_instance_details)
+                report.change = instances['Change']
+                if instances['Change'] == RESCHEDULED:
+                    report.previous_deadline = instances['PreviousDeadline']
+                reports.append(report)
+                handled.append(instances)
+            except Exception as e:
+                print("Event of instance {} could not be processed: {}".format(instances['InstanceId'], e))
+                logger.info("Event of instance {} could not be processed: {}".format(instances['InstanceId'], e))
+
+        # Filter to identify support teams DL (per account routing, the whole page is routed at once)
+        with stage_timer.span('routing'):
+            for report, recipient in zip(reports, routing_table.route_batch(reports)):
+                report.recipient = recipient
+
+        with stage_timer.span('S3 dedup'):
+            sent_events = {get_object_summary(report): ledger.is_sent(account_name, report.instance_id, report.code,
+                                                                       report.deadline, get_object_summary(report))
+                           for report in reports}
+            if head_fallback:
+                unknown_events = [object_summary for object_summary, sent in sent_events.items() if not sent]
+                sent_events.update(tracker.check_sent(unknown_events))
+                ledger.add_tracker_objects(object_summary for object_summary in unknown_events if sent_events[object_summary])
+        for report in reports:
+            object_summary = get_object_summary(report)
+            if sent_events[object_summary]:
+                print("The Event {} is already sent to {} and has been uploaded in S3 bucket.".format(object_summary, report.recipient))
+                logger.info("The Event {} is already sent to {} and has been uploaded in S3 bucket.".format(object_summary, report.recipient))
+            elif sent_events[object_summary] is False:
+                dispatcher.submit('ledger', notify_event, account_name, account, clients, ledger, dispatcher, logger, report, digest)
+
+        # Handled events are only compared against on the next run, an event whose check failed stays new (or rescheduled)
+        for instances, report in zip(handled, reports):
+            if sent_events[get_object_summary(report)] is not None:
+                detector.store_report(account_name, region, instances, report)
+
+    return filter_page, handle_page
+
+
+# Function to scan a single account and notify its events, or only notify the events collected from AWS Health
+def scan_account(account_name, account, routing_table, args, catalog, ledger, teams_sender, detector, collected=None):
+
+    logger = get_account_logger(account_name, account['log_file'])
+    session = get_account_session(account_name, account, args.use_default_credentials)
+
+    # Setup temp client to get list of available regions
+    ec2_conn = create_client(session, 'ec2', 'us-east-1')
+    clients = get_account_clients(session, args, teams_sender)
+
+    # Getting list of available regions for the account (cached), skipping regions without instances on most runs
+    with stage_timer.span('region discovery'):
+        regions = region_catalog.get_regions(catalog, account_name, ec2_conn, args.region_ttl)
+        if collected is None:
+            regions, skipped_regions = region_catalog.select_regions(catalog, account_name, regions, args.empty_region_runs,
+                                                                     args.empty_region_scan_every)
+        else:
+            # Collected events cover every region, none is skipped
+            regions, skipped_regions = sorted(set(regions) | set(collected)), []
+    if skipped_regions:
+        print("[{}] Skipping {} regions without instances: {}".format(account_name, len(skipped_regions), ', '.join(skipped_regions)))
+        logger.info("Skipping {} regions without instances: {}".format(len(skipped_regions), ', '.join(skipped_regions)))
+
+    # Sent events are checked against the local notification ledger, synced in bulk from the S3 events tracker
+    tracker = EventTracker(clients['s3'], TRACKER_BUCKET, TRACKER_PREFIX, args.tracker_list_limit, compress=args.tracker_gzip)
+    with stage_timer.span('S3 dedup'):
+        head_fallback = not ledger.sync_from_s3(tracker, args.ledger_sync_interval)
+    if head_fallback:
+        print("[{}] S3 events tracker could not be listed, checking new events with head_object.".format(account_name))
+        logger.info("S3 events tracker could not be listed, checking new events with head_object.")
+
+    # New events grouped by recipient DL in digest mode, kept across retries since claimed events are not claimed again
+    digest = {} if args.digest else None
+
+    # Notifications are dispatched by their own workers so slow sinks never stall the scan
+    dispatcher = Dispatcher({'ledger': 1, 'ses': args.ses_workers, 'teams': args.teams_workers}, args.queue_size, logger)
+
+    # Every worker of the dispatcher is stopped whatever fails, they would otherwise wait on their queue forever
+    try:
+        filter_page, handle_page = get_page_handlers(account_name, account, routing_table, clients, ledger, detector, tracker,
+                                                     head_fallback, dispatcher, logger, digest)
+
+        run_start = time()
+        detector.start_run(account_name)
+        # Scan, enrich and notify every region available for the account concurrently
+        region_results = scan_regions(session, regions, handle_page, args.max_workers, args.max_results, filter_page,
+                                      args.lookahead_days, collected)
+        if collected is None:
+            region_catalog.record_region_results(catalog, account_name, region_results)
+        instances_described = sum(region_result['InstancesDescribed'] for region_result in region_results)
+        describe_calls = sum(region_result['DescribeCalls'] for region_result in region_results)
+
+        # Summary of the API calls saved by the batched instance enrichment
+        print("[{}] Enriched {} instances with {} describe_instances calls ({} calls saved)."
+              .format(account_name, instances_described, describe_calls, instances_described - describe_calls))
+        logger.info("Enriched {} instances with {} describe_instances calls ({} calls saved)."
+                    .format(instances_described, describe_calls, instances_described - describe_calls))
+
+        # Summary of the time spent scanning each region
+        for region_result in region_results:
+            if 'Error' in region_result:
+                print("[{}] Region {} failed after {:.2f}s: {}"
+                      .format(account_name, region_result['Region'], region_result['Elapsed'], region_result['Error']))
+                logger.info("Region {} failed after {:.2f}s: {}"
+                            .format(region_result['Region'], region_result['Elapsed'], region_result['Error']))
+                continue
+            print("[{}] Region {} scanned in {:.2f}s ({} events, {} changed, {} pages)."
+                  .format(account_name, region_result['Region'], region_result['Elapsed'], region_result['Events'],
+                          region_result['ChangedEvents'], region_result['Pages']))
+            logger.info("Region {} scanned in {:.2f}s ({} events, {} changed, {} pages)."
+                        .format(region_result['Region'], region_result['Elapsed'], region_result['Events'],
+                                region_result['ChangedEvents'], region_result['Pages']))
+        print("[{}] Scanned {} regions with {} workers in {:.2f}s.".format(account_name, len(regions), args.max_workers, time() - run_start))
+        logger.info("Scanned {} regions with {} workers in {:.2f}s.".format(len(regions), args.max_workers, time() - run_start))
+
+        # Every new event has been claimed once the ledger jobs are drained
+        dispatcher.drain(['ledger'])
+
+        # Events no longer listed in the regions scanned successfully are notified as cleared, out of their stored reports
+        cleared_reports = detector.finish_run(account_name, [region_result['Region'] for region_result in region_results
+                                                             if 'Error' not in region_result])
+        for report in cleared_reports:
+            report.change = CLEARED
+            print("Event cleared - {} and has been sent to {}".format(get_object_summary(report), report.recipient))
+            logger.info("Event cleared - {} and has been sent to {}".format(get_object_summary(report), report.recipient))
+            if digest is not None:
+                digest.setdefault(report.recipient, []).append(report)
+            else:
+                dispatcher.submit('ses', send_email, clients['ses'], report.recipient, [report])
+            dispatcher.submit('teams', clients['teams'].add, account['chat_channel'], account['card_title'], report)
+        print("[{}] Event changes: {}".format(account_name, detector.stats[account_name]))
+        logger.info("Event changes: {}".format(detector.stats[account_name]))
+
+        # Sending one digest email per recipient DL
+        if digest:
+            for recipient, reports in sorted(digest.items()):
+                dispatcher.submit('ses', send_email, clients['ses'], recipient, reports)
+                print("[{}] Digest of {} events queued for {}".format(account_name, len(reports), recipient))
+                logger.info("Digest of {} events queued for {}".format(len(reports), recipient))
+            events = sum(len(reports) for reports in digest.values())
+            print("[{}] Sent {} events in {} emails ({:.1f} events per email).".format(account_name, events, len(digest), float(events) / len(digest)))
+            logger.info("Sent {} events in {} emails ({:.1f} events per email).".format(events, len(digest), float(events) / len(digest)))
+
+        dispatcher.drain(['ses', 'teams'])
+        print("[{}] Dispatch summary: {}".format(account_name, dispatcher.stats))
+        logger.info("Dispatch summary: {}".format(dispatcher.stats))
+        print("[{}] SES summary: {}".format(account_name, clients['ses'].summary()))
+        logger.info("SES summary: {}".format(clients['ses'].summary()))
+    finally:
+        dispatcher.drain()
+
+    # Upload the events recorded during this run to the S3 events tracker
+    try:
+        with stage_timer.span('tracker upload'):
+            uploaded = ledger.sync_to_s3(tracker, account_name)
+        print("[{}] Uploaded {} events to the S3 events tracker, requests: {}".format(account_name, uploaded, tracker.requests))
+        logger.info("Uploaded {} events to the S3 events tracker, requests: {}".format(uploaded, tracker.requests))
+    except Exception as e:
+        print("[{}] S3 events tracker sync failed, it will be retried on the next run: {}".format(account_name, e))
+        logger.info("S3 events tracker sync failed, it will be retried on the next run: {}".format(e))
+
+    # Summary of the API calls of the account
+    for line in api_metrics.summary(account_name):
+        print("[{}] {}".format(account_name, line))
+        logger.info(line)
+
+
+def parse_args(argv=None):
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--account', action='append', choices=sorted(ACCOUNTS),
+                        help='account to scan, can be repeated (default: every configured account)')
+    parser.add_argument('--max-workers', type=int, default=8,
+                        help='number of regions scanned concurrently per account (1 scans the regions one after another)')
+    parser.add_argument('--max-results', type=int, default=1000,
+                        help='page size of the describe_instance_status scan (5 to 1000)')
+    parser.add_argument('--source', choices=['scan', 'health'], default='scan',
+                        help='where the events come from: a describe_instance_status scan of every region of every account, '
+                             'or the AWS Health organizational view of all the accounts at once')
+    parser.add_argument('--health-account', choices=sorted(ACCOUNTS),
+                        help='account reading the AWS Health organizational view, the management account or a delegated '
+                             'administrator (default: the first scanned account)')
+    parser.add_argument('--lookahead-days', type=int, default=0,
+                        help='only handle events starting within this many days, later events are picked up by a later run '
+                             '(0 handles every event)')
+    parser.add_argument('--region-cache', default='region_catalog.json',
+                        help='file caching the enabled regions and empty region counters of each account')
+    parser.add_argument('--region-ttl', type=int, default=24 * 3600,
+                        help='seconds before the cached region list is refreshed through describe_regions')
+    parser.add_argument('--empty-region-runs', type=int, default=3,
+                        help='consecutive runs without instances after which a region is scanned less often')
+    parser.add_argument('--empty-region-scan-every', type=int, default=6,
+                        help='regions without instances are only scanned every Nth run (1 scans them on every run)')
+    parser.add_argument('--tracker-list-limit', type=int, default=100000,
+                        help='maximum number of S3 tracker keys listed in memory before falling back to head_object checks')
+    parser.add_argument('--tracker-gzip', action='store_true',
+                        help='gzip the event records uploaded to the S3 events tracker')
+    parser.add_argument('--ledger', default='notifications.db',
+                        help='SQLite notification ledger holding the already notified events')
+    parser.add_argument('--ledger-sync-interval', type=int, default=3600,
+                        help='seconds between two listings of the S3 events tracker into the ledger')
+    parser.add_argument('--digest', action='store_true',
+                        help='send one email per recipient DL listing all its new events instead of one email per event')
+    parser.add_argument('--max-attempts', type=int, default=10,
+                        help='attempts per API call (adaptive retry mode with jittered backoff) before the call fails')
+    parser.add_argument('--max-pool-connections', type=int, default=16,
+                        help='HTTP connections kept open per client, at least the 16 S3 events tracker upload workers')
+    parser.add_argument('--queue-size', type=int, default=1000,
+                        help='maximum number of queued notification jobs per sink before the scan waits (backpressure)')
+    parser.add_argument('--ses-workers', type=int, default=2,
+                        help='number of concurrent SES senders per account')
+    parser.add_argument('--ses-headroom', type=float, default=0.9,
+                        help='fraction of the account SES maximum send rate used by the sends')
+    parser.add_argument('--teams-workers', type=int, default=2,
+                        help='number of concurrent MS teams senders per account')
+    parser.add_argument('--teams-connect-timeout', type=float, default=5,
+                        help='seconds to wait for the MS teams webhook connection')
+    parser.add_argument('--teams-read-timeout', type=float, default=15,
+                        help='seconds to wait for the MS teams webhook response')
+    parser.add_argument('--metrics-file',
+                        help='Prometheus textfile collector file (*.prom) receiving the API call metrics of the run')
+    parser.add_argument('--profile', action='store_true',
+                        help='print the time spent in each stage of the run (summed across the worker threads)')
+    parser.add_argument('--profile-output',
+                        help='write the cProfile stats of every thread of the run to this pstats file')
+    parser.add_argument('--profile-memory', type=int, default=0, metavar='N',
+                        help='trace memory allocations and print the N largest allocation sites at the end of the run')
+    parser.add_argument('--record', metavar='FIXTURE',
+                        help='record every AWS call and MS teams post of the run to this JSONL fixture')
+    parser.add_argument('--replay', metavar='FIXTURE',
+                        help='run out of a recorded fixture: no credentials, no network, no emails or MS teams posts, '
+                             'local state in memory')
+    parser.add_argument('--daemon', action='store_true',
+                        help='keep running and scan every --interval seconds, clients and local state stay warm between scans')
+    parser.add_argument('--interval', type=int, default=300,
+                        help='seconds between the start of two scans in daemon mode')
+    parser.add_argument('--sqs-queue-url',
+                        help='daemon mode: ingest the AWS Health EC2 scheduled changes forwarded by EventBridge to this SQS queue '
+                             'between the scans, each notified within seconds (use a longer --interval for the scans)')
+    parser.add_argument('--sqs-account', choices=sorted(ACCOUNTS),
+                        help='account whose credentials read the SQS queue (default: the first scanned account)')
+    parser.add_argument('--sqs-endpoint-url',
+                        help='endpoint of a local SQS stand-in (ElasticMQ, LocalStack...) replacing the AWS one')
+    parser.add_argument('--use-default-credentials', action='store_true',
+                        help='ignore the configured profile/role and use the default credential chain (single account only)')
+    args = parser.parse_args(argv)
+
+    if args.account is None:
+        args.account = list(ACCOUNTS)
+    if args.use_default_credentials and len(args.account) > 1:
+        parser.error('--use-default-credentials can only be used with a single --account')
+    if args.daemon and args.replay:
+        parser.error('--daemon cannot be used with --replay')
+    if args.sqs_queue_url and not args.daemon:
+        parser.error('--sqs-queue-url can only be used with --daemon')
+    if args.sqs_account is None:
+        args.sqs_account = args.account[0]
+    if args.health_account is None:
+        args.health_account = args.account[0]
+
+    return args
+
+
+# Function to get the AWS account ID of each scanned account, matched against the account of the queued events
+def get_account_ids(args):
+
+    account_ids = {}
+    for account_name in args.account:
+        try:
+            session = get_account_session(account_name, ACCOUNTS[account_name], args.use_default_credentials)
+            account_ids[create_client(session, 'sts').get_caller_identity()['Account']] = account_name
+        except Exception as e:
+            print("[{}] Account ID could not be resolved: {}".format(account_name, e))
+
+    return account_ids
+
+
+# Function to get the events of the failed jobs of a dispatcher: the event of a ledger job (notify_event) and the events
+# of an email job (send_email). MS teams failures are reported by the sender, a card holds the events of earlier jobs.
+def get_failed_reports(dispatcher):
+
+    reports = [args[6] for args in dispatcher.failures['ledger']]
+    reports.extend(report for args in dispatcher.failures['ses'] for report in args[2])
+
+    return reports
+
+
+# Function to notify the events announced for some instances of an account, per region. The instances are looked up
+# like on a scan and diffed against the last scan. Returns the regions whose events could not all be notified, the
+# events whose delivery failed are released so they are notified again when their messages are received again.
+def ingest_account(account_name, account, regions, routing_table, args, ledger, teams_sender, detector, clients):
+
+    logger = get_account_logger(account_name, account['log_file'])
+    session = get_account_session(account_name, account, args.use_default_credentials)
+    tracker = EventTracker(clients['s3'], TRACKER_BUCKET, TRACKER_PREFIX, args.tracker_list_limit, compress=args.tracker_gzip)
+    dispatcher = Dispatcher({'ledger': 1, 'ses': args.ses_workers, 'teams': args.teams_workers}, args.queue_size, logger)
+    # Every worker of the dispatcher is stopped whatever fails, they would otherwise wait on their queue forever
+    try:
+        filter_page, handle_page = get_page_handlers(account_name, account, routing_table, clients, ledger, detector, tracker,
+                                                     False, dispatcher, logger)
+        deadline = get_lookahead_deadline(args.lookahead_days)
+        instance_regions = {instance_id: region for region, instance_ids in regions.items() for instance_id in instance_ids}
+
+        failed_regions = set()
+        for region, instance_ids in sorted(regions.items()):
+            try:
+                ec2_conn = create_client(session, 'ec2', region)
+                listed_events, changed_events, instances_described, api_calls = process_page(
+                    ec2_conn, region, describe_instance_events(ec2_conn, instance_ids), handle_page, filter_page, deadline)
+                print("[{}] Queued events of {} instances in {}: {} events, {} changed."
+                      .format(account_name, len(instance_ids), region, listed_events, changed_events))
+                logger.info("Queued events of {} instances in {}: {} events, {} changed."
+                            .format(len(instance_ids), region, listed_events, changed_events))
+            except Exception as e:
+                failed_regions.add(region)
+                print("[{}] Queued events in {} could not be handled, they will be received again: {}".format(account_name, region, e))
+                logger.info("Queued events in {} could not be handled, they will be received again: {}".format(region, e))
+
+        # Notifications are delivered before the messages are deleted
+        dispatcher.drain(['ledger', 'ses', 'teams'])
+    finally:
+        dispatcher.drain()
+    try:
+        teams_sender.flush()
+    except Exception as e:
+        print("[{}] MS teams delivery failed: {}".format(account_name, e))
+        logger.info("MS teams delivery failed: {}".format(e))
+    # Undelivered events are released before the ledger is synced to the S3 events tracker
+    for report in get_failed_reports(dispatcher) + teams_sender.take_failed():
+        ledger.release(account_name, report.instance_id, report.code, report.deadline)
+        detector.revert(account_name, report)
+        failed_regions.add(instance_regions[report.instance_id])
+        print("[{}] Event {} could not be delivered, it will be received again.".format(account_name, get_object_summary(report)))
+        logger.info("Event {} could not be delivered, it will be received again.".format(get_object_summary(report)))
+    try:
+        with stage_timer.span('tracker upload'):
+            ledger.sync_to_s3(tracker, account_name)
+    except Exception as e:
+        print("[{}] S3 events tracker sync failed, it will be retried on the next run: {}".format(account_name, e))
+        logger.info("S3 events tracker sync failed, it will be retried on the next run: {}".format(e))
+
+    return failed_regions
+
+
+# Function to handle a batch of queue messages. Messages announcing no EC2 scheduled change of a scanned account are
+# dropped, the others are deleted once their events have been notified and left in the queue otherwise.
+def ingest_messages(event_queue, messages, account_ids, args, ledger, teams_sender, detector, routing_tables, account_clients):
+
+    affected = {}
+    message_keys = []
+    for message in messages:
+        event = get_affected_instances(message['Body'])
+        account_name = account_ids.get(event[0]) if event is not None else None
+        if account_name is None:
+            event_queue.stats['ignored'] += 1
+            message_keys.append(None)
+            continue
+        affected.setdefault(account_name, {}).setdefault(event[1], set()).update(event[2])
+        message_keys.append((account_name, event[1]))
+
+    failed = set()
+    for account_name, regions in sorted(affected.items()):
+        # The queued events are diffed against the last scan of the account, none has run yet when it failed
+        if account_name not in detector.runs:
+            failed.update((account_name, region) for region in regions)
+            continue
+        try:
+            # Notification clients are kept along the session they were created from
+            session = get_account_session(account_name, ACCOUNTS[account_name], args.use_default_credentials)
+            if account_clients.get(account_name, (None, None))[0] is not session:
+                account_clients[account_name] = (session, get_account_clients(session, args, teams_sender))
+            failed_regions = ingest_account(account_name, ACCOUNTS[account_name],
+                                            {region: sorted(instance_ids) for region, instance_ids in regions.items()},
+                                            routing_tables[account_name], args, ledger, teams_sender, detector,
+                                            account_clients[account_name][1])
+        except Exception as e:
+            print("[{}] Queued events could not be handled, they will be received again: {}".format(account_name, e))
+            failed_regions = regions
+        failed.update((account_name, region) for region in failed_regions)
+
+    handled = [message for message, key in zip(messages, message_keys) if key not in failed]
+    if handled and event_queue.delete(handled):
+        print("Some queue messages could not be deleted, they will be received again.")
+
+
+# Function to consume the event queue until the given time (the next scan) or until the daemon is stopped
+def consume_queue(event_queue, until, stop, args, ledger, teams_sender, detector, routing_tables, account_ids, account_clients):
+
+    while not stop.is_set() and time() < until:
+        try:
+            messages = event_queue.receive(max(1, int(until - time())))
+            if messages:
+                with stage_timer.span('queue ingestion'):
+                    ingest_messages(event_queue, messages, account_ids, args, ledger, teams_sender, detector, routing_tables,
+                                    account_clients)
+        except Exception as e:
+            print("Event queue could not be consumed: {}".format(e))
+            stop.wait(min(event_queue.wait_time, max(0, until - time())))
+
+
+# Function to run one scan of every account, everything it is given is kept warm between the cycles of the daemon
+def scan_cycle(args, catalog, ledger, detector, teams_sender, routing_tables, health_collector=None, account_ids=None):
+
+    start_time = time()
+    # Every cycle reports its own numbers
+    api_metrics.reset()
+    stage_timer.reset()
+    teams_events, teams_posts, teams_failed_posts = teams_sender.events, teams_sender.posts, teams_sender.failed_posts
+    # Profiling mode: stage spans, cProfile of every thread and tracemalloc snapshot
+    if args.profile_output:
+        profiler = ThreadProfiler()
+        profiler.start()
+    if args.profile_memory:
+        # Only imported when asked for, like the record / replay support
+        import tracemalloc
+        tracemalloc.start()
+
+    # The events of every account are collected at once from AWS Health, an account whose ID is unknown is scanned
+    collected = {}
+    if health_collector is not None:
+        with stage_timer.span('health collection'):
+            health_events = health_collector.collect(account_ids)
+        collected = {account_name: health_events.get(account_id, {}) for account_id, account_name in account_ids.items()}
+        print("Collected the events of {} accounts from AWS Health, requests: {}".format(len(collected), health_collector.requests))
+
+    # Every account runs in its own thread, failures are reported per account
+    with ThreadPoolExecutor(max_workers=len(args.account)) as executor:
+        futures = {account_name: executor.submit(scan_account, account_name, ACCOUNTS[account_name], routing_tables[account_name],
+                                                 args, catalog, ledger, teams_sender, detector, collected.get(account_name))
+                   for account_name in args.account}
+    for account_name, future in futures.items():
+        if future.exception() is not None:
+            print("[{}] Scan failed: {}".format(account_name, future.exception()))
+    if replayer is None:
+        region_catalog.save_catalog(args.region_cache, catalog)
+    try:
+        teams_sender.flush()
+    except Exception as e:
+        print("MS teams delivery failed: {}".format(e))
+    print("Posted {} events in {} MS teams cards ({} events in {} cards not posted).".format(
+        teams_sender.events - teams_events, teams_sender.posts - teams_posts, len(teams_sender.take_failed()),
+        teams_sender.failed_posts - teams_failed_posts))
+
+    for line in api_metrics.summary():
+        print(line)
+    if args.metrics_file:
+        api_metrics.write_prometheus(args.metrics_file, time() - start_time)
+    print("Scanned {} accounts in {:.2f}s.".format(len(args.account), time() - start_time))
+
+    if args.profile:
+        for line in stage_timer.summary():
+            print(line)
+    if args.profile_output:
+        profiler.stop(args.profile_output).sort_stats('cumulative').print_stats(20)
+        print("cProfile stats written to {}".format(args.profile_output))
+    if args.profile_memory:
+        snapshot = tracemalloc.take_snapshot()
+        print("Peak traced memory: {:.1f} MB".format(tracemalloc.get_traced_memory()[1] / 1024.0 / 1024.0))
+        tracemalloc.stop()
+        for statistic in snapshot.statistics('lineno')[:args.profile_memory]:
+            print(statistic)
+
+
+# Function to scan every interval until SIGTERM or SIGINT, a cycle in progress is always completed. With an event
+# queue, the queued events are ingested between the scans, which then act as a low frequency reconciliation.
+def run_daemon(args, event_queue, catalog, ledger, detector, teams_sender, routing_tables, health_collector, account_ids):
+
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        print("Received signal {}, stopping after the current cycle.".format(signum))
+        stop.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    account_clients = {}
+    cycle = 0
+    while not stop.is_set():
+        cycle += 1
+        cycle_start = time()
+        print("Scan cycle {} started at {}".format(cycle, datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')))
+        try:
+            scan_cycle(args, catalog, ledger, detector, teams_sender, routing_tables, health_collector, account_ids)
+        except Exception as e:
+            print("Scan cycle {} failed: {}".format(cycle, e))
+        # Cycles start every interval, a cycle longer than the interval is followed by the next one right away
+        if event_queue is not None:
+            consume_queue(event_queue, cycle_start + args.interval, stop, args, ledger, teams_sender, detector, routing_tables,
+                          account_ids, account_clients)
+            print("Event queue: {}, requests: {}".format(event_queue.stats, event_queue.requests))
+        else:
+            stop.wait(max(0, args.interval - (time() - cycle_start)))
+    print("Daemon stopped after {} cycles.".format(cycle))
+
+
+def main(argv=None):
+
+    global client_factory, recorder, replayer
+
+    setup_start = perf_counter()
+    args = parse_args(argv)
+    # Every call starts cold, sessions and clients are only kept for the cycles of this call, and so are the recorder
+    # and replayer (their hooks are registered on those sessions)
+    _account_sessions.clear()
+    client_factory = ClientFactory(args.max_attempts, args.max_pool_connections)
+    recorder = replayer = None
+    stage_timer.enabled = args.profile
+    # Record / replay support is only imported when used
+    if args.record:
+        from replay import Recorder
+        recorder = Recorder(args.record)
+    if args.replay:
+        from replay import Replayer
+        # A replay starts from empty local state, dedup comes from the recorded S3 events tracker listing
+        replayer = Replayer(args.replay)
+        args.ledger = ':memory:'
+    catalog = region_catalog.load_catalog(args.region_cache) if replayer is None else {}
+    ledger = NotificationLedger(args.ledger)
+    # Events of the previous run are kept along the notification ledger
+    detector = ChangeDetector(args.ledger)
+    # MS teams cards are shared by the accounts and posted through a single keep-alive session
+    teams_sender = TeamsSender(timeout=(args.teams_connect_timeout, args.teams_read_timeout))
+    teams_sender.session.hooks['response'].append(api_metrics.record_teams_post)
+    if recorder is not None:
+        teams_sender.session.hooks['response'].append(recorder.record_teams_post)
+    if replayer is not None:
+        replayer.mount_teams(teams_sender.session)
+
+    # Routing rules are compiled once for the whole run
+    routing_tables = {account_name: compile_routing(ACCOUNTS[account_name]['routing']) for account_name in args.account}
+
+    # AWS Health organizational view, read with the credentials of the management (or delegated administrator) account
+    health_collector = None
+    if args.source == 'health':
+        health_session = get_account_session(args.health_account, ACCOUNTS[args.health_account], args.use_default_credentials)
+        health_collector = HealthCollector(create_client(health_session, 'health', 'us-east-1'))
+    # Queued and collected events name their AWS account ID
+    account_ids = get_account_ids(args) if args.sqs_queue_url or health_collector is not None else {}
+    setup_time = perf_counter() - setup_start
+
+    if args.daemon:
+        event_queue = None
+        if args.sqs_queue_url:
+            sqs_session = get_account_session(args.sqs_account, ACCOUNTS[args.sqs_account], args.use_default_credentials)
+            event_queue = EventQueue(create_client(sqs_session, 'sqs', get_queue_region(args.sqs_queue_url), args.sqs_endpoint_url),
+                                     args.sqs_queue_url)
+        run_daemon(args, event_queue, catalog, ledger, detector, teams_sender, routing_tables, health_collector, account_ids)
+    else:
+        scan_cycle(args, catalog, ledger, detector, teams_sender, routing_tables, health_collector, account_ids)
+
+    teams_sender.session.close()
+    ledger.close()
+    detector.close()
+    if recorder is not None:
+        recorder.close()
+        print("Recorded {} calls to {}".format(recorder.records, args.record))
+    if replayer is not None:
+        print("Replayed from {}: {}".format(args.replay, replayer.stats))
+    if args.profile:
+        print("Startup: {:.3f}s imports, {:.3f}s setup (local state, routing, MS teams session)".format(_import_time, setup_time))
+        for line in client_factory.summary():
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
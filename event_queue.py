@@ -0,0 +1,87 @@
+"""
+SQS queue of the EC2 scheduled changes published by AWS Health, forwarded by an EventBridge rule.
+
+The queue is long-polled in batches of up to 10 messages. A message is only used to learn which instances of which
+account and region have a new or changed scheduled event: their events are then read through describe_instance_status
+like on a full scan, so both paths see the same event IDs, descriptions and deadlines. Messages are deleted by the
+consumer once the events they announce have been delivered (a failed email or MS teams card keeps the message and
+releases its events in the notification ledger), a message left in the queue is received again after its
+visibility timeout (and goes to the dead-letter queue of the redrive policy after too many attempts).
+
+Note:
+    EventBridge rule pattern: {"source": ["aws.health"], "detail-type": ["AWS Health Event"], "detail": {"service":
+    ["EC2"], "eventTypeCategory": ["scheduledChange"]}}, target the queue with the event as message body.
+
+"""
+
+import json
+
+HEALTH_SOURCE = 'aws.health'
+
+# SQS limits: messages per receive / delete batch and long polling wait time
+MAX_BATCH_SIZE = 10
+MAX_WAIT_TIME = 20
+
+
+# Function to get the (account ID, region, instance IDs) affected by an EventBridge message, None for any other message
+def get_affected_instances(body):
+
+    try:
+        event = json.loads(body)
+    except ValueError:
+        return None
+    if not isinstance(event, dict) or event.get('source') != HEALTH_SOURCE:
+        return None
+    detail = event.get('detail') or {}
+    if detail.get('service') != 'EC2':
+        return None
+
+    # Resources are instance IDs or instance ARNs, affected entities repeat them
+    resources = [resource.rsplit('/', 1)[-1] for resource in event.get('resources', [])]
+    resources.extend(entity.get('entityValue') for entity in detail.get('affectedEntities', []))
+    instance_ids = sorted({resource for resource in resources if resource and resource.startswith('i-')})
+    if not instance_ids or not event.get('account') or not event.get('region'):
+        return None
+
+    return event['account'], event['region'], instance_ids
+
+
+class EventQueue(object):
+
+    def __init__(self, sqs_client, queue_url, wait_time=MAX_WAIT_TIME, batch_size=MAX_BATCH_SIZE):
+        self.client = sqs_client
+        self.queue_url = queue_url
+        self.wait_time = min(wait_time, MAX_WAIT_TIME)
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.requests = {'receive_message': 0, 'delete_message_batch': 0}
+        self.stats = {'received': 0, 'deleted': 0, 'ignored': 0}
+
+    # Long-polls a batch of messages, returns as soon as a message is available or after the wait time
+    def receive(self, wait_time=None):
+
+        self.requests['receive_message'] += 1
+        response = self.client.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=self.batch_size,
+            WaitTimeSeconds=self.wait_time if wait_time is None else max(0, min(wait_time, self.wait_time))
+        )
+        messages = response.get('Messages', [])
+        self.stats['received'] += len(messages)
+
+        return messages
+
+    # Deletes handled messages, returns the number of messages that could not be deleted
+    def delete(self, messages):
+
+        failed = 0
+        for start in range(0, len(messages), MAX_BATCH_SIZE):
+            batch = messages[start:start + MAX_BATCH_SIZE]
+            self.requests['delete_message_batch'] += 1
+            response = self.client.delete_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[{'Id': str(index), 'ReceiptHandle': message['ReceiptHandle']} for index, message in enumerate(batch)]
+            )
+            failed += len(response.get('Failed', []))
+            self.stats['deleted'] += len(response.get('Successful', []))
+
+        return failed
@@ -0,0 +1,77 @@
+"""
+S3 events tracker for the EC2 scheduled events notification engine.
+
+Every notified event is recorded as an object under the tracker prefix. Instead of one get_object call per event,
+the tracker prefix is listed in bulk with list_objects_v2 by the notification ledger sync (see ledger.py), which
+keeps the keys in its database. When the prefix holds more keys than the listing limit or cannot be listed, the
+events of each page are checked with concurrent head_object calls instead.
+
+Tracker objects hold the JSON record of the event, gzipped (Content-Encoding: gzip) when compress is set.
+
+"""
+
+import gzip
+import threading
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+
+
+class EventTracker(object):
+
+    def __init__(self, s3_client, bucket, prefix, list_limit=100000, max_workers=16, compress=False):
+        self.s3_client = s3_client
+        self.compress = compress
+        self.bucket = bucket
+        self.prefix = prefix
+        self.list_limit = list_limit
+        self.max_workers = max_workers
+        self.requests = {'list_objects_v2': 0, 'head_object': 0, 'put_object': 0}
+        self._lock = threading.Lock()
+
+    # Lists the object names under the tracker prefix, None when the prefix is larger than list_limit or cannot be listed
+    def list_sent_events(self):
+
+        sent_events = set()
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        try:
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+                self.requests['list_objects_v2'] += 1
+                sent_events.update(content['Key'][len(self.prefix):] for content in page.get('Contents', []))
+                if len(sent_events) > self.list_limit:
+                    return None
+        except ClientError:
+            # Listing may not be allowed on the bucket, events are checked one by one instead
+            return None
+
+        return sent_events
+
+    # Checks a single event with head_object, None when the check itself failed (e.g. access denied)
+    def _head_event(self, object_name):
+
+        with self._lock:
+            self.requests['head_object'] += 1
+        try:
+            self.s3_client.head_object(Bucket=self.bucket, Key=self.prefix + object_name)
+            return True
+        except ClientError as ex:
+            if ex.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            return None
+
+    # Returns a dict of object name -> sent (True/False, None when unknown) for a batch of events
+    def check_sent(self, object_names):
+
+        object_names = list(dict.fromkeys(object_names))
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return dict(zip(object_names, executor.map(self._head_event, object_names)))
+
+    # Records an event as sent in the tracker
+    def mark_sent(self, object_name, body):
+
+        if self.compress:
+            self.s3_client.put_object(Bucket=self.bucket, Key=self.prefix + object_name, Body=gzip.compress(body.encode('utf-8')),
+                                      ContentType='application/json', ContentEncoding='gzip')
+        else:
+            self.s3_client.put_object(Bucket=self.bucket, Key=self.prefix + object_name, Body=body, ContentType='application/json')
+        with self._lock:
+            self.requests['put_object'] += 1
@@ -0,0 +1,116 @@
+"""
+AWS Health organizational view collector of the EC2 scheduled events notification engine.
+
+Instead of a describe_instance_status scan of every region of every account, the scheduled EC2 events of all the
+accounts are read at once from the AWS Health API: describe_events_for_organization lists the upcoming and open
+scheduled changes and describe_affected_entities_for_organization their instances (10 events per call). Every affected
+instance is turned into the instance status record describe_instance_status returns, grouped per account and region,
+so the records go through the same change detection, enrichment, routing and notification as a scan. Health
+timestamps are epoch numbers parsed in the local timezone, they are converted to UTC like the EC2 timestamps so both
+sources give the same deadlines.
+
+Note:
+    The organizational view must be enabled for AWS Health and the collector must run with the credentials of the
+    management account or of a delegated administrator. Health events carry no EC2 event ID, change detection matches
+    them on their instance, code and deadline (see change_detection.py): an account switched between the collector
+    and the scan sees its events as unchanged, they are neither notified again nor cleared. The descriptions below
+    are generic, the engine looks up the EC2 description of the changed events (the S3 events tracker names events
+    after it).
+
+"""
+
+from datetime import timezone
+
+# EC2 event codes of the AWS Health event types collected
+HEALTH_EVENT_CODES = {
+    'AWS_EC2_INSTANCE_STOP_SCHEDULED': 'instance-stop',
+    'AWS_EC2_INSTANCE_REBOOT_MAINTENANCE_SCHEDULED': 'instance-reboot',
+    'AWS_EC2_SYSTEM_REBOOT_MAINTENANCE_SCHEDULED': 'system-reboot',
+    'AWS_EC2_INSTANCE_NETWORK_MAINTENANCE_SCHEDULED': 'system-maintenance',
+    'AWS_EC2_INSTANCE_POWER_MAINTENANCE_SCHEDULED': 'system-maintenance',
+    'AWS_EC2_INSTANCE_RETIREMENT_SCHEDULED': 'instance-retirement'
+}
+
+# Descriptions of the collected events, AWS Health only has the long event description
+EVENT_DESCRIPTIONS = {
+    'instance-stop': 'The instance is running on degraded hardware',
+    'instance-reboot': 'The instance is scheduled for a reboot',
+    'system-reboot': 'The system is scheduled for a reboot',
+    'system-maintenance': 'The system is scheduled for maintenance',
+    'instance-retirement': 'The instance is scheduled for retirement'
+}
+
+# Affected entities still to be handled (resolved ones are over)
+ENTITY_STATUS_CODES = ['IMPAIRED', 'UNIMPAIRED', 'UNKNOWN', 'PENDING']
+
+# describe_affected_entities_for_organization accepts up to 10 events per call
+EVENTS_PER_CALL = 10
+
+
+class HealthCollector(object):
+
+    def __init__(self, health_client, page_size=100):
+        self.client = health_client
+        self.page_size = page_size
+        self.requests = {'describe_events_for_organization': 0, 'describe_affected_entities_for_organization': 0}
+
+    # Lists the open and upcoming scheduled EC2 events of the accounts
+    def _describe_events(self, account_ids):
+
+        events = {}
+        paginator = self.client.get_paginator('describe_events_for_organization')
+        pages = paginator.paginate(
+            filter={
+                'services': ['EC2'],
+                'eventTypeCategories': ['scheduledChange'],
+                'eventTypeCodes': sorted(HEALTH_EVENT_CODES),
+                'eventStatusCodes': ['open', 'upcoming'],
+                'awsAccountIds': sorted(account_ids)
+            },
+            PaginationConfig={'PageSize': self.page_size}
+        )
+        for page in pages:
+            self.requests['describe_events_for_organization'] += 1
+            # An event is only notified once it has a start time
+            for event in page['events']:
+                if event.get('startTime') is not None:
+                    events[event['arn']] = event
+
+        return events
+
+    # Returns the instance statuses of the scheduled events of the accounts: {account ID: {region: [instance status]}}.
+    # A partial answer would clear the missing events, failed lookups are raised instead.
+    def collect(self, account_ids):
+
+        events = self._describe_events(account_ids)
+        collected = {}
+        paginator = self.client.get_paginator('describe_affected_entities_for_organization')
+        event_arns = sorted(events)
+        for start in range(0, len(event_arns), EVENTS_PER_CALL):
+            pages = paginator.paginate(
+                organizationEntityAccountFilters=[{'eventArn': event_arn, 'statusCodes': ENTITY_STATUS_CODES}
+                                                  for event_arn in event_arns[start:start + EVENTS_PER_CALL]],
+                PaginationConfig={'PageSize': self.page_size}
+            )
+            for page in pages:
+                self.requests['describe_affected_entities_for_organization'] += 1
+                if page.get('failedSet'):
+                    failed = page['failedSet'][0]
+                    raise RuntimeError('Affected entities of {} could not be described: {} {}'.format(
+                        failed.get('eventArn'), failed.get('errorName'), failed.get('errorMessage')))
+                for entity in page['entities']:
+                    instance_id = entity.get('entityValue') or ''
+                    if entity.get('awsAccountId') not in account_ids or not instance_id.startswith('i-'):
+                        continue
+                    event = events[entity['eventArn']]
+                    code = HEALTH_EVENT_CODES[event['eventTypeCode']]
+                    collected.setdefault(entity['awsAccountId'], {}).setdefault(event['region'], []).append({
+                        'InstanceId': instance_id,
+                        'Events': [{
+                            'Code': code,
+                            'Description': EVENT_DESCRIPTIONS[code],
+                            'NotBefore': event['startTime'].astimezone(timezone.utc)
+                        }]
+                    })
+
+        return collected
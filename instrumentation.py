@@ -0,0 +1,155 @@
+"""
+API call instrumentation for the EC2 scheduled events notification engine.
+
+Every AWS call is timed through the botocore before-call / after-call events registered on the account sessions,
+retries and throttled attempts are counted through needs-retry. MS teams webhook posts are recorded through a
+requests response hook. Calls are broken down per account, region, service and operation.
+
+At the end of the run the numbers are logged as a summary and written as a Prometheus textfile collector file. In
+daemon mode they are reset at the start of every cycle and cover the last cycle only.
+
+"""
+
+import os
+import threading
+from time import perf_counter, time
+
+# Error codes of throttled AWS calls
+THROTTLING_CODES = ('Throttling', 'ThrottlingException', 'ThrottledException', 'RequestLimitExceeded', 'TooManyRequestsException',
+                    'RequestThrottled', 'RequestThrottledException', 'SlowDown', 'MaxSendingRateExceeded')
+
+# Prometheus metrics: (name, type, help, stat)
+PROMETHEUS_METRICS = (
+    ('aws_events_api_calls_total', 'counter', 'API calls', 'calls'),
+    ('aws_events_api_errors_total', 'counter', 'API calls that failed after their retries', 'errors'),
+    ('aws_events_api_retries_total', 'counter', 'API call retries', 'retries'),
+    ('aws_events_api_throttles_total', 'counter', 'Throttled API call attempts', 'throttles'),
+    ('aws_events_api_latency_seconds_total', 'counter', 'Total API call latency, retries included', 'latency'),
+    ('aws_events_api_latency_max_seconds', 'gauge', 'Slowest API call latency, retries included', 'max_latency')
+)
+
+
+# Function to get the latency of a call out of its context, 0 when the call was answered before being timed
+def get_latency(context):
+
+    start = context.get('metrics_start')
+    return perf_counter() - start if start is not None else 0.0
+
+
+class ApiMetrics(object):
+
+    def __init__(self):
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    # Records a call under its account, region, service and operation
+    def record(self, account, region, service, operation, latency=0.0, retries=0, throttles=0, error=False):
+
+        key = (account or 'all', region or 'global', service, operation)
+        with self._lock:
+            stats = self.stats.get(key)
+            if stats is None:
+                stats = self.stats[key] = {'calls': 0, 'errors': 0, 'retries': 0, 'throttles': 0, 'latency': 0.0, 'max_latency': 0.0}
+            stats['calls'] += 1
+            stats['errors'] += 1 if error else 0
+            stats['retries'] += retries
+            stats['throttles'] += throttles
+            stats['latency'] += latency
+            stats['max_latency'] = max(stats['max_latency'], latency)
+
+    # Clears the numbers recorded so far (start of a daemon cycle), the session hooks stay registered
+    def reset(self):
+        with self._lock:
+            self.stats = {}
+
+    # Instruments every client created from the session afterwards
+    def register(self, session, account):
+
+        session.register('before-call', self._before_call)
+        session.register('after-call', lambda **kwargs: self._after_call(account, **kwargs))
+        session.register('after-call-error', lambda **kwargs: self._after_call_error(account, **kwargs))
+        session.register('needs-retry', self._needs_retry)
+
+    # after-call-error is only emitted with the exception and the context, the operation is kept in the context
+    def _before_call(self, model, context, **kwargs):
+        context['metrics_operation'] = (model.service_model.service_name, model.name)
+        context['metrics_start'] = perf_counter()
+        context['metrics_throttles'] = 0
+
+    # Throttled attempts, the retry decision is left to the botocore retry handler
+    def _needs_retry(self, response=None, request_dict=None, **kwargs):
+
+        if response is not None and request_dict is not None:
+            if response[1].get('Error', {}).get('Code') in THROTTLING_CODES:
+                context = request_dict['context']
+                context['metrics_throttles'] = context.get('metrics_throttles', 0) + 1
+
+    def _after_call(self, account, http_response, parsed, model, context, **kwargs):
+
+        self.record(account, context.get('client_region'), model.service_model.service_name, model.name, get_latency(context),
+                    parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0), context.get('metrics_throttles', 0),
+                    http_response.status_code >= 300)
+
+    # Calls failing without a response (connection errors once retried)
+    def _after_call_error(self, account, exception, context, **kwargs):
+
+        service, operation = context.get('metrics_operation', ('unknown', 'unknown'))
+        self.record(account, context.get('client_region'), service, operation, get_latency(context), error=True)
+
+    # Response hook of the MS teams session, urllib3 retries are read from the retry history
+    def record_teams_post(self, response, *args, **kwargs):
+
+        retries = getattr(response.raw, 'retries', None)
+        history = retries.history if retries is not None else ()
+        self.record(None, None, 'teams', 'post', response.elapsed.total_seconds(), len(history),
+                    sum(1 for attempt in history if attempt.status == 429), response.status_code >= 300)
+
+        return response
+
+    # Totals per (service, operation), optionally for a single account
+    def totals(self, account=None):
+
+        totals = {}
+        with self._lock:
+            for (stats_account, region, service, operation), stats in self.stats.items():
+                if account is not None and stats_account != account:
+                    continue
+                total = totals.setdefault((service, operation), {'calls': 0, 'errors': 0, 'retries': 0, 'throttles': 0,
+                                                                 'latency': 0.0, 'max_latency': 0.0})
+                for stat in ('calls', 'errors', 'retries', 'throttles', 'latency'):
+                    total[stat] += stats[stat]
+                total['max_latency'] = max(total['max_latency'], stats['max_latency'])
+
+        return totals
+
+    # Summary lines of the calls per operation, optionally for a single account
+    def summary(self, account=None):
+
+        return ["API {}.{}: {} calls, {} errors, {} retries, {} throttled, {:.3f}s average, {:.3f}s max latency".format(
+                    service, operation, total['calls'], total['errors'], total['retries'], total['throttles'],
+                    total['latency'] / total['calls'], total['max_latency'])
+                for (service, operation), total in sorted(self.totals(account).items())]
+
+    # Writes the metrics in the Prometheus text format (temp file first, the collector never reads a partial file)
+    def write_prometheus(self, path, run_duration=None):
+
+        with self._lock:
+            stats = sorted(self.stats.items())
+        lines = []
+        for name, metric_type, help_text, stat in PROMETHEUS_METRICS:
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} {}'.format(name, metric_type))
+            for (account, region, service, operation), values in stats:
+                lines.append('{}{{account="{}",region="{}",service="{}",operation="{}"}} {}'.format(
+                    name, account, region, service, operation, values[stat]))
+        if run_duration is not None:
+            lines.extend(['# HELP aws_events_run_duration_seconds Duration of the last run',
+                          '# TYPE aws_events_run_duration_seconds gauge',
+                          'aws_events_run_duration_seconds {}'.format(run_duration)])
+        lines.extend(['# HELP aws_events_last_run_timestamp_seconds End time of the last run',
+                      '# TYPE aws_events_last_run_timestamp_seconds gauge',
+                      'aws_events_last_run_timestamp_seconds {}'.format(time())])
+
+        with open(path + '.tmp', 'w') as metrics_file:
+            metrics_file.write('\n'.join(lines) + '\n')
+        os.replace(path + '.tmp', path)
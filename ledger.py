@@ -0,0 +1,177 @@
+"""
+Local notification ledger for the EC2 scheduled events notification engine.
+
+The "already notified" state lives in an indexed SQLite database keyed by account, instance, event code and
+NotBefore. The S3 events tracker is only touched during the sync steps: sync_from_s3 lists the tracker prefix in
+bulk (at most once per sync interval) and sync_to_s3 uploads the notifications recorded since the last sync.
+
+Note:
+    claim() is atomic, an event is claimed by exactly one caller even when several threads (or processes sharing
+    the same database file) see it at the same time.
+
+"""
+
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS notifications (
+    account TEXT NOT NULL,
+    instance_id TEXT NOT NULL,
+    event_code TEXT NOT NULL,
+    not_before TEXT NOT NULL,
+    object_name TEXT NOT NULL,
+    recipient TEXT,
+    report TEXT,
+    claimed_at REAL NOT NULL,
+    synced INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (account, instance_id, event_code, not_before)
+);
+CREATE INDEX IF NOT EXISTS notifications_not_before ON notifications (not_before);
+CREATE INDEX IF NOT EXISTS notifications_unsynced ON notifications (synced, account);
+CREATE TABLE IF NOT EXISTS tracker_objects (
+    object_name TEXT PRIMARY KEY
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+
+class NotificationLedger(object):
+
+    def __init__(self, path='notifications.db'):
+        self.path = path
+        self._lock = threading.Lock()
+        # Held across a whole sync_from_s3, so concurrent accounts wait for the listing in progress instead of listing too
+        self._sync_lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # Checks whether an event has been notified, either through this ledger or by an object in the S3 tracker
+    def is_sent(self, account, instance_id, event_code, not_before, object_name):
+
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT 1 FROM notifications WHERE account = ? AND instance_id = ? AND event_code = ? AND not_before = ? '
+                'UNION ALL SELECT 1 FROM tracker_objects WHERE object_name = ? LIMIT 1',
+                (account, instance_id, event_code, not_before, object_name)).fetchone()
+
+        return row is not None
+
+    # Atomically claims an event for notification, returns False when it has already been claimed or sent
+    def claim(self, account, instance_id, event_code, not_before, object_name, recipient, report):
+
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                if self._conn.execute('SELECT 1 FROM tracker_objects WHERE object_name = ?', (object_name,)).fetchone():
+                    claimed = False
+                else:
+                    cursor = self._conn.execute(
+                        'INSERT OR IGNORE INTO notifications '
+                        '(account, instance_id, event_code, not_before, object_name, recipient, report, claimed_at) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                        (account, instance_id, event_code, not_before, object_name, recipient, report, time()))
+                    claimed = cursor.rowcount == 1
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+
+        return claimed
+
+    # Releases the claim of an event whose notification failed so it can be claimed again, events already uploaded to
+    # the S3 events tracker are kept
+    def release(self, account, instance_id, event_code, not_before):
+
+        with self._lock:
+            self._conn.execute('DELETE FROM notifications WHERE account = ? AND instance_id = ? AND event_code = ? AND not_before = ? '
+                               'AND synced = 0', (account, instance_id, event_code, not_before))
+
+    # Records S3 tracker objects known to exist (already notified by another run or host)
+    def add_tracker_objects(self, object_names):
+
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            self._conn.executemany('INSERT OR IGNORE INTO tracker_objects (object_name) VALUES (?)',
+                                   ((object_name,) for object_name in object_names))
+            self._conn.execute('COMMIT')
+
+    # Returns the notifications whose deadline (NotBefore) falls within [start, end), ordered by deadline
+    def get_notifications_due(self, start, end, account=None):
+
+        query = 'SELECT account, instance_id, event_code, not_before, recipient, report FROM notifications ' \
+                'WHERE not_before >= ? AND not_before < ?'
+        params = [start, end]
+        if account is not None:
+            query += ' AND account = ?'
+            params.append(account)
+        with self._lock:
+            rows = self._conn.execute(query + ' ORDER BY not_before', params).fetchall()
+
+        return [dict(zip(('Account', 'InstanceID', 'Code', 'NotBefore', 'Recipient', 'Report'), row)) for row in rows]
+
+    def _get_meta(self, name):
+        row = self._conn.execute('SELECT value FROM meta WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, name, value):
+        self._conn.execute('INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)', (name, str(value)))
+
+    # Pulls the S3 tracker keys into the ledger unless a listing younger than max_age is already there.
+    # Returns False when the tracker could not be listed and no recent listing is available.
+    def sync_from_s3(self, tracker, max_age):
+
+        # Serialized so concurrent accounts list the tracker only once
+        with self._sync_lock:
+            with self._lock:
+                synced_at = self._get_meta('tracker_synced_at')
+            if synced_at is not None and time() - float(synced_at) < max_age:
+                return True
+
+            object_names = tracker.list_sent_events()
+            if object_names is None:
+                return False
+            self.add_tracker_objects(object_names)
+            with self._lock:
+                self._set_meta('tracker_synced_at', time())
+
+        return True
+
+    # Uploads the notifications recorded since the last sync to the S3 tracker, returns the number uploaded
+    def sync_to_s3(self, tracker, account=None, max_workers=16):
+
+        query = 'SELECT account, instance_id, event_code, not_before, object_name, report FROM notifications WHERE synced = 0'
+        params = []
+        if account is not None:
+            query += ' AND account = ?'
+            params.append(account)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+
+        def upload(row):
+            tracker.mark_sent(row[4], row[5])
+            return row
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            uploaded = list(executor.map(upload, rows))
+
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            self._conn.executemany(
+                'UPDATE notifications SET synced = 1 WHERE account = ? AND instance_id = ? AND event_code = ? AND not_before = ?',
+                (row[:4] for row in uploaded))
+            self._conn.executemany('INSERT OR IGNORE INTO tracker_objects (object_name) VALUES (?)',
+                                   ((row[4],) for row in uploaded))
+            self._conn.execute('COMMIT')
+
+        return len(uploaded)
@@ -0,0 +1,116 @@
+"""
+Profiling mode of the EC2 scheduled events notification engine.
+
+StageTimer accumulates timing spans per stage of the run (region discovery, status scan, enrichment, tag parsing,
+routing, S3 dedup, SES send, MS teams post...). Spans run in the region and dispatch workers, so the time of a
+stage is summed across threads and can exceed the wall time of the run. When disabled, span() is a shared no-op.
+
+ThreadProfiler runs cProfile in every thread started while it is enabled and merges their stats in one pstats dump.
+From Python 3.12 cProfile is built on sys.monitoring: only one profiler can be active per process and it already sees
+the calls of every thread, so a single profiler is started instead.
+
+"""
+
+import cProfile
+import pstats
+import sys
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+# cProfile profiles every thread from a single profiler (sys.monitoring) from Python 3.12
+PROCESS_WIDE_PROFILER = sys.version_info >= (3, 12)
+
+
+class _NoSpan(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_no_span = _NoSpan()
+
+
+class StageTimer(object):
+
+    def __init__(self):
+        self.enabled = False
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    # Times the enclosed block under the stage
+    def span(self, stage):
+
+        if not self.enabled:
+            return _no_span
+        return self._span(stage)
+
+    @contextmanager
+    def _span(self, stage):
+
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - start
+            with self._lock:
+                stats = self.stages.setdefault(stage, {'time': 0.0, 'spans': 0, 'max': 0.0})
+                stats['time'] += elapsed
+                stats['spans'] += 1
+                stats['max'] = max(stats['max'], elapsed)
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}
+
+    # Breakdown lines of the stages, by decreasing time
+    def summary(self):
+
+        with self._lock:
+            stages = sorted(self.stages.items(), key=lambda item: -item[1]['time'])
+        return ["Stage {:<20} {:>9.3f}s in {:>7} spans ({:.3f}s max)".format(stage, stats['time'], stats['spans'], stats['max'])
+                for stage, stats in stages]
+
+
+class ThreadProfiler(object):
+
+    def __init__(self):
+        self.profiles = []
+        self._lock = threading.Lock()
+
+    def _enable(self):
+        profile = cProfile.Profile()
+        with self._lock:
+            self.profiles.append(profile)
+        profile.enable()
+
+    # Installed as the profile hook of new threads, replaced by their own profiler on their first call
+    def _start_thread(self, frame, event, arg):
+        sys.setprofile(None)
+        self._enable()
+
+    def start(self):
+        if not PROCESS_WIDE_PROFILER:
+            threading.setprofile(self._start_thread)
+        self._enable()
+
+    # Stops profiling and writes the merged stats of every thread
+    def stop(self, path):
+
+        if not PROCESS_WIDE_PROFILER:
+            threading.setprofile(None)
+        with self._lock:
+            profiles = list(self.profiles)
+        for profile in profiles:
+            profile.disable()
+        stats = pstats.Stats(*profiles)
+        stats.dump_stats(path)
+
+        return stats
+
+
+# Stage timer shared by the engine modules, enabled by --profile
+stage_timer = StageTimer()
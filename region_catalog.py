@@ -0,0 +1,90 @@
+"""
+Region catalog for the EC2 scheduled events notification engine.
+
+The list of regions enabled for each account is cached on disk and only refreshed through describe_regions once
+the TTL has expired. The catalog also keeps, per account, how many consecutive runs found a region without any
+instance; once a region reaches the empty runs threshold it is only scanned every Kth run.
+
+Note:
+    Regions are enabled based on their opt-in status, regions not opted in are never scanned.
+
+"""
+
+import json
+import os
+import threading
+from time import time
+
+# Regions that can be scanned (enabled by default or opted in by the account)
+ENABLED_OPT_IN_STATUSES = ('opt-in-not-required', 'opted-in')
+
+# The catalog is shared by the account threads
+_catalog_lock = threading.Lock()
+
+
+# Function to load the region catalog from disk, a missing or unreadable file gives an empty catalog
+def load_catalog(path):
+
+    try:
+        with open(path) as catalog_file:
+            return json.load(catalog_file)
+    except (IOError, ValueError):
+        return {}
+
+
+# Function to save the region catalog to disk (written to a temp file first so a crash never leaves it truncated)
+def save_catalog(path, catalog):
+
+    with _catalog_lock:
+        with open(path + '.tmp', 'w') as catalog_file:
+            json.dump(catalog, catalog_file, indent=2, sort_keys=True)
+        os.replace(path + '.tmp', path)
+
+
+# Function to get the account section of the catalog
+def get_account_entry(catalog, account_name):
+
+    with _catalog_lock:
+        return catalog.setdefault(account_name, {'regions': [], 'fetched_at': 0, 'runs': 0, 'empty_runs': {}})
+
+
+# Function to get the enabled regions of an account, describe_regions is only called once the cached list expired
+def get_regions(catalog, account_name, ec2_conn, ttl):
+
+    entry = get_account_entry(catalog, account_name)
+    if not entry['regions'] or time() - entry['fetched_at'] > ttl:
+        entry['regions'] = sorted(region['RegionName'] for region in ec2_conn.describe_regions(AllRegions=True)['Regions']
+                                  if region.get('OptInStatus', 'opt-in-not-required') in ENABLED_OPT_IN_STATUSES)
+        entry['fetched_at'] = time()
+        # Forget regions that are no longer enabled
+        entry['empty_runs'] = {region: count for region, count in entry['empty_runs'].items() if region in entry['regions']}
+
+    return list(entry['regions'])
+
+
+# Function to select the regions to scan this run, regions empty for empty_threshold runs are only scanned every Kth run
+def select_regions(catalog, account_name, regions, empty_threshold, empty_scan_every):
+
+    entry = get_account_entry(catalog, account_name)
+    entry['runs'] += 1
+    if empty_scan_every <= 1 or entry['runs'] % empty_scan_every == 0:
+        return list(regions), []
+
+    scanned = [region for region in regions if entry['empty_runs'].get(region, 0) < empty_threshold]
+    skipped = [region for region in regions if entry['empty_runs'].get(region, 0) >= empty_threshold]
+
+    return scanned, skipped
+
+
+# Function to record which scanned regions had instances, resetting or increasing their empty runs counter
+def record_region_results(catalog, account_name, region_results):
+
+    entry = get_account_entry(catalog, account_name)
+    for region_result in region_results:
+        # A failed region tells nothing about its instances
+        if 'Error' in region_result:
+            continue
+        if region_result['HasInstances']:
+            entry['empty_runs'].pop(region_result['Region'], None)
+        else:
+            entry['empty_runs'][region_result['Region']] = entry['empty_runs'].get(region_result['Region'], 0) + 1
@@ -0,0 +1,106 @@
+"""
+Notification rendering for the EC2 scheduled events notification engine.
+
+Every notification format is rendered from the same ScheduledEvent records: the HTML email, its plain text
+alternative and the MS teams MessageCard sections. The templates are compiled once at import into format
+functions, a batch of events is rendered in a single call (one row per event, sorted by deadline) and every
+tag value is escaped.
+
+"""
+
+from html import escape
+
+from change_detection import CLEARED, NEW, RESCHEDULED
+
+EMAIL_COLUMNS = ('AWS Account', 'Region', 'Name', 'Instance ID', 'Description', 'Deadline', 'Status')
+
+# Compiled templates
+_html_row = ('<tr>' + '<td>{}</td>' * len(EMAIL_COLUMNS) + '</tr>').format
+_html_body = ('<br>Hi Team,<br><br>{}<br><br>'
+              '<table border="1"><tr>' + ''.join('<th>' + column + '</th>' for column in EMAIL_COLUMNS) + '</tr>{}</table>'
+              '<br><br>For degraded hardware event, kindly perform an AWS instance stop/start via AWS console or use CSP Admin '
+              'function SGW - Instance Stop/Start. '
+              '<br><br><b> -- Please do not reply to this email -- </b>').format
+_text_row = ' | '.join(['{}'] * len(EMAIL_COLUMNS)).format
+_text_body = ('Hi Team,\n\n{}\n\n' + ' | '.join(EMAIL_COLUMNS) + '\n{}\n\n'
+              'For degraded hardware event, kindly perform an AWS instance stop/start via AWS console or use CSP Admin '
+              'function SGW - Instance Stop/Start.\n\n -- Please do not reply to this email -- \n').format
+
+NEW_INTRO = ('We have received an AWS scheduled event alert for the below customer{}. Kindly complete the required action '
+             'based on the event description prior the indicated deadline to avoid unexpected outage.')
+CLEARED_INTRO = 'The AWS scheduled event{} below {} no longer listed (completed or canceled), no further action is required.'
+
+
+# Function to get the status shown for an event in the notifications (new, deadline moved or cleared)
+def get_change_status(report):
+
+    if report.change == RESCHEDULED:
+        return "Deadline moved from " + report.previous_deadline
+    return report.change or NEW
+
+
+# Function to get the values of the email columns of an event
+def get_columns(report):
+
+    return (report.account_id, report.region, report.name or '', report.instance_id, report.description,
+            report.deadline + ' UTC+8', get_change_status(report))
+
+
+# Function to get the subject and introduction of an email, based on the changes of its events
+def get_subject(reports):
+
+    plural = len(reports) > 1
+    changes = set(report.change or NEW for report in reports)
+    if changes == {CLEARED}:
+        return "AWS Scheduled Event Cleared", CLEARED_INTRO.format("s" if plural else "", "are" if plural else "is")
+    if changes == {RESCHEDULED}:
+        return "AWS Scheduled Event Rescheduled", NEW_INTRO.format("s" if plural else "")
+    return "AWS Scheduled Event Notification", NEW_INTRO.format("s" if plural else "")
+
+
+# Function to render the email of a batch of events: returns its subject, HTML body and plain text body
+def render_email(reports):
+
+    subject, intro = get_subject(reports)
+    columns = [get_columns(report) for report in sorted(reports, key=lambda report: (report.deadline, report.instance_id, report.code))]
+    html_rows = ''.join([_html_row(*[escape(value) for value in row]) for row in columns])
+    text_rows = '\n'.join([_text_row(*row) for row in columns])
+
+    return subject, _html_body(intro, html_rows), _text_body(intro, text_rows)
+
+
+# Function to render the MessageCard section of an event
+def render_section(report):
+
+    facts = [
+        ("AWS ACcount: ", report.account_id),
+        ("Region: ", report.region),
+        ("Instance ID: ", report.instance_id),
+        ("Name: ", report.name or ''),
+        ("Alias: ", report.customer_prefix or ''),
+        ("Owner: ", report.recipient),
+        ("Description: ", report.description),
+        ("Deadline: ", report.deadline)
+    ]
+    # Status of the event since the previous run (new, deadline moved or cleared)
+    if report.change is not None:
+        facts.append(("Status: ", get_change_status(report)))
+
+    return {
+        "activityTitle": "Instance Description",
+        "facts": [{"name": name, "value": escape(value, quote=False)} for name, value in facts],
+        "markdown": False
+    }
+
+
+# Function to render the MessageCard holding the sections of a batch of events
+def render_card(card_title, sections):
+
+    return {
+        "@type": "MessageCard",
+        "@context": "http://schema.org/extensions",
+        "themeColor": "ff0000",
+        "title": "AWS Scheduled Report: ",
+        "text": escape(card_title, quote=False),
+        "sections": sections
+    }
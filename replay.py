@@ -0,0 +1,209 @@
+"""
+Record / replay of the AWS and MS teams traffic of the EC2 scheduled events notification engine.
+
+Recorder captures every botocore call (account, service, region, operation, parameters, HTTP status and parsed
+response) and every MS teams post of a run into a JSONL fixture, one call per line. Replayer runs the same logic
+out of a fixture without credentials or network: calls are answered from the before-call event, before any
+request is signed or sent, and MS teams posts are answered by a local transport adapter.
+
+Calls are matched on their account, service, region, operation and parameters. describe_instances calls are
+also answered from every instance recorded, so the enrichment can be chunked differently, and write calls
+(send_email, put_object) are answered whatever their content, so changed notifications can be replayed and
+recorded again for comparison.
+
+Note:
+    Record with a fresh --ledger to capture every event of the wave: events unchanged since the previous run are
+    never enriched, so their instances would be missing from the fixture.
+
+"""
+
+import base64
+import json
+import threading
+from datetime import datetime
+
+import requests
+from botocore.awsrequest import AWSResponse
+from requests.adapters import BaseAdapter
+
+# Calls answered by operation only, their parameters (rendered notifications, tracker objects) may differ on replay
+WRITE_OPERATIONS = ('SendEmail', 'PutObject')
+WRITE_RESPONSES = {'SendEmail': {'MessageId': 'replay'}, 'PutObject': {}}
+
+
+# Function to encode the values JSON has no type for (timestamps, bytes, streams)
+def encode_value(value):
+
+    if isinstance(value, datetime):
+        return {'$datetime': value.isoformat()}
+    if isinstance(value, bytes):
+        return {'$bytes': base64.b64encode(value).decode('ascii')}
+    # Streams (object bodies) are left unread for the caller
+    return {'$unrecorded': type(value).__name__}
+
+
+# Function to decode the values encoded by encode_value
+def decode_value(obj):
+
+    if '$datetime' in obj:
+        return datetime.fromisoformat(obj['$datetime'])
+    if '$bytes' in obj:
+        return base64.b64decode(obj['$bytes'])
+    return obj
+
+
+# Function to get the matching key of a call
+def get_call_key(account, service, region, operation, params):
+
+    return json.dumps([account, service, region, operation, params], sort_keys=True, default=encode_value)
+
+
+class Recorder(object):
+
+    def __init__(self, path):
+        self.records = 0
+        self._file = open(path, 'w')
+        self._lock = threading.Lock()
+
+    def _write(self, record):
+        line = json.dumps(record, separators=(',', ':'), sort_keys=True, default=encode_value)
+        with self._lock:
+            self._file.write(line + '\n')
+            self.records += 1
+
+    # Records every call of the clients created from the session afterwards
+    def register(self, session, account):
+
+        session.register('provide-client-params', self._provide_params)
+        session.register('after-call', lambda **kwargs: self._after_call(account, **kwargs))
+
+    def _provide_params(self, params, context, **kwargs):
+        context['record_params'] = dict(params)
+
+    def _after_call(self, account, http_response, parsed, model, context, **kwargs):
+
+        response = dict(parsed)
+        response.pop('ResponseMetadata', None)
+        self._write({
+            'account': account,
+            'service': model.service_model.service_name,
+            'region': context.get('client_region'),
+            'operation': model.name,
+            'params': context.get('record_params', {}),
+            'status': http_response.status_code,
+            'response': response
+        })
+
+    # Response hook of the MS teams session
+    def record_teams_post(self, response, *args, **kwargs):
+
+        body = response.request.body
+        self._write({
+            'service': 'teams',
+            'operation': 'post',
+            'params': json.loads(body) if body else None,
+            'status': response.status_code
+        })
+
+        return response
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class ReplayTeamsAdapter(BaseAdapter):
+
+    def __init__(self, replayer):
+        super(ReplayTeamsAdapter, self).__init__()
+        self.replayer = replayer
+
+    def send(self, request, **kwargs):
+
+        response = requests.Response()
+        response.status_code = self.replayer.teams_status
+        response.url = request.url
+        response.request = request
+        response._content = b'1'
+        with self.replayer._lock:
+            self.replayer.stats['teams'] += 1
+
+        return response
+
+    def close(self):
+        pass
+
+
+class Replayer(object):
+
+    def __init__(self, path):
+        self.calls = {}
+        self.instances = {}
+        self.write_responses = {}
+        self.teams_status = 200
+        self.stats = {'replayed': 0, 'missing': 0, 'teams': 0}
+        self._lock = threading.Lock()
+        with open(path) as fixture:
+            for line in fixture:
+                if line.strip():
+                    self._load(json.loads(line, object_hook=decode_value))
+
+    def _load(self, record):
+
+        if record['service'] == 'teams':
+            self.teams_status = record['status']
+            return
+        key = get_call_key(record['account'], record['service'], record['region'], record['operation'], record['params'])
+        self.calls.setdefault(key, []).append((record['status'], record['response']))
+        if record['operation'] in WRITE_OPERATIONS:
+            self.write_responses.setdefault((record['account'], record['operation']), (record['status'], record['response']))
+        if record['operation'] == 'DescribeInstances' and record['status'] < 300:
+            for reservation in record['response'].get('Reservations', []):
+                for instance in reservation['Instances']:
+                    self.instances[(record['account'], instance['InstanceId'])] = (reservation['OwnerId'], instance)
+
+    # Answers every call of the clients created from the session afterwards out of the fixture (the session needs
+    # static credentials, none are looked up)
+    def register(self, session, account):
+
+        session.register('provide-client-params', self._provide_params)
+        session.register('before-call', lambda **kwargs: self._before_call(account, **kwargs))
+
+    # MS teams posts of the session are answered locally
+    def mount_teams(self, session):
+        session.mount('https://', ReplayTeamsAdapter(self))
+        session.mount('http://', ReplayTeamsAdapter(self))
+
+    def _provide_params(self, params, context, **kwargs):
+        context['replay_params'] = dict(params)
+
+    # Answers the call, the request is never sent
+    def _before_call(self, account, model, context, **kwargs):
+
+        status, response = self._find(account, model.service_model.service_name, context.get('client_region'), model.name,
+                                      context.get('replay_params', {}))
+        response = dict(response, ResponseMetadata={'HTTPStatusCode': status, 'HTTPHeaders': {}, 'RetryAttempts': 0})
+
+        return AWSResponse('replay', status, {}, None), response
+
+    def _find(self, account, service, region, operation, params):
+
+        key = get_call_key(account, service, region, operation, params)
+        with self._lock:
+            responses = self.calls.get(key)
+            if responses:
+                self.stats['replayed'] += 1
+                # Identical calls are answered in the recorded order, the last answer is kept for any further call
+                return responses.pop(0) if len(responses) > 1 else responses[0]
+            if operation == 'DescribeInstances' and params.get('Filters'):
+                instance_ids = [value for item in params['Filters'] if item['Name'] == 'instance-id' for value in item['Values']]
+                found = [self.instances[(account, instance_id)] for instance_id in instance_ids if (account, instance_id) in self.instances]
+                self.stats['replayed'] += 1
+                return 200, {'Reservations': [{'OwnerId': owner_id, 'Instances': [instance]} for owner_id, instance in found]}
+            if operation in WRITE_OPERATIONS:
+                self.stats['replayed'] += 1
+                return self.write_responses.get((account, operation), (200, WRITE_RESPONSES[operation]))
+            self.stats['missing'] += 1
+
+        return 400, {'Error': {'Code': 'ReplayNotRecorded', 'Message': 'No recorded response for {}.{} in {}'.format(
+            service, operation, region)}}
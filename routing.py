@@ -0,0 +1,91 @@
+"""
+Routing engine for the EC2 scheduled events notification engine.
+
+Routing rules are declared as data in accounts.py and compiled once at startup. A rule is a list of conditions on
+the report tags and the recipient DL used when all conditions match, rules are evaluated in order and the first
+match wins. Conditions are tuples:
+
+    ('CostCenter', 'present')                   tag is set
+    ('Product', 'absent')                       tag is not set
+    ('CostCenter', 'in', [...])                 tag value is one of the values (exact match)
+    ('Owner', 'contains', [...])                tag value contains one of the values
+
+Consecutive single 'in' rules on the same tag are compiled into one dict lookup, value lists into frozensets and
+'contains' values into a single precompiled regular expression.
+
+"""
+
+import re
+
+
+# Compiles a single condition into a predicate taking a report
+def compile_condition(condition):
+
+    tag, operator = condition[0], condition[1]
+    if operator == 'present':
+        return lambda report: tag in report
+    if operator == 'absent':
+        return lambda report: tag not in report
+    if operator == 'in':
+        values = frozenset(condition[2])
+        return lambda report: report.get(tag) in values
+    if operator == 'contains':
+        search = re.compile('|'.join(re.escape(value) for value in condition[2])).search
+        return lambda report: tag in report and search(report[tag]) is not None
+
+    raise ValueError('Unknown routing operator {!r} in condition {!r}'.format(operator, condition))
+
+
+class RoutingTable(object):
+
+    def __init__(self, rules, default):
+        self.default = default
+        self.tags = tuple(sorted({condition[0] for rule in rules for condition in rule['conditions']}))
+        self.steps = []
+
+        for rule in rules:
+            conditions = rule['conditions']
+            if len(conditions) == 1 and conditions[0][1] == 'in':
+                tag = conditions[0][0]
+                # Merge into the previous lookup step when it is on the same tag (first rule wins on duplicates)
+                if self.steps and self.steps[-1][0] == 'lookup' and self.steps[-1][1] == tag:
+                    index = self.steps[-1][2]
+                else:
+                    index = {}
+                    self.steps.append(('lookup', tag, index))
+                for value in conditions[0][2]:
+                    index.setdefault(value, rule['recipient'])
+            else:
+                self.steps.append(('rule', tuple(compile_condition(condition) for condition in conditions), rule['recipient']))
+
+    # Resolves the recipient DL of a single report
+    def route(self, report):
+
+        for step in self.steps:
+            if step[0] == 'lookup':
+                recipient = step[2].get(report.get(step[1]))
+                if recipient is not None:
+                    return recipient
+            elif all(predicate(report) for predicate in step[1]):
+                return step[2]
+
+        return self.default
+
+    # Resolves the recipients of a batch of reports, reports with the same routing tags are only routed once
+    def route_batch(self, reports):
+
+        recipients = []
+        resolved = {}
+        for report in reports:
+            key = tuple(report.get(tag) for tag in self.tags)
+            if key not in resolved:
+                resolved[key] = self.route(report)
+            recipients.append(resolved[key])
+
+        return recipients
+
+
+# Compiles the routing rules of an account
+def compile_routing(routing):
+
+    return RoutingTable(routing['rules'], routing['default'])
@@ -0,0 +1,117 @@
+"""
+Scheduled event record of the EC2 scheduled events notification engine.
+
+A ScheduledEvent replaces the report dict built per event: a fixed set of slots filled in a single pass over the
+instance tags, with the strings repeated across events (region, account, code, description, recipient) interned.
+Records are stored as compact JSON (optionally gzipped) keyed by the report names, so they can be read back.
+
+Note:
+    Records keep the mapping lookups used by the routing rules (get, in, []) under the report names
+    ('AWS Account', 'customerPrefix', ...), unset fields read as missing.
+
+"""
+
+import gzip
+import json
+import sys
+
+# Instance tags kept on the record, by tag key
+TAG_FIELDS = {
+    'Name': 'name',
+    'customerPrefix': 'customer_prefix',
+    'CostCenter': 'cost_center',
+    'Service': 'service',
+    'Product': 'product',
+    'Owner': 'owner'
+}
+
+# Report names of the record fields, used by the routing rules and the stored records
+FIELDS = dict({
+    'Region': 'region',
+    'AWS Account': 'account_id',
+    'Description': 'description',
+    'InstanceID': 'instance_id',
+    'Deadline': 'deadline',
+    'Code': 'code',
+    'Recipient': 'recipient',
+    'Change': 'change',
+    'PreviousDeadline': 'previous_deadline'
+}, **TAG_FIELDS)
+
+# Fields shared by many events, interned so each distinct value is held once
+INTERNED_FIELDS = ('region', 'account_id', 'description', 'code', 'recipient', 'change')
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+class ScheduledEvent(object):
+
+    __slots__ = tuple(FIELDS.values())
+
+    def __init__(self, **fields):
+        for field in self.__slots__:
+            value = fields.get(field)
+            if value is not None and field in INTERNED_FIELDS:
+                value = sys.intern(value)
+            setattr(self, field, value)
+
+    # Builds the record of an instance event out of its status and enriched details
+    @classmethod
+    def from_instance(cls, instances, ec2_instance_details):
+
+        event = instances['Events'][0]
+        scheduled_event = cls(region=ec2_instance_details['AvailabilityZone'], account_id=ec2_instance_details['OwnerId'],
+                              description=event['Description'], instance_id=instances['InstanceId'],
+                              deadline=str(event['NotBefore']), code=event['Code'])
+
+        # Acquire instance tags information (Name, Customer Prefix, CostCenter, Service, Product, Owner) in one pass
+        for tag in ec2_instance_details['Tags']:
+            field = TAG_FIELDS.get(tag['Key'])
+            if field is not None:
+                setattr(scheduled_event, field, tag['Value'])
+
+        return scheduled_event
+
+    # Mapping lookups by report name, as used by the routing rules
+    def get(self, key, default=None):
+        field = FIELDS.get(key)
+        value = getattr(self, field) if field is not None else None
+        return default if value is None else value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __eq__(self, other):
+        return isinstance(other, ScheduledEvent) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return 'ScheduledEvent({!r})'.format(self.to_dict())
+
+    # Set fields by report name
+    def to_dict(self):
+        return {key: getattr(self, field) for key, field in FIELDS.items() if getattr(self, field) is not None}
+
+    @classmethod
+    def from_dict(cls, report):
+        return cls(**{FIELDS[key]: value for key, value in report.items() if key in FIELDS})
+
+    # Compact JSON of the record
+    def to_json(self):
+        return json.dumps(self.to_dict(), separators=(',', ':'), sort_keys=True)
+
+    # Reads a record back from its JSON, gzipped or not
+    @classmethod
+    def from_json(cls, data):
+
+        if isinstance(data, bytes):
+            if data.startswith(GZIP_MAGIC):
+                data = gzip.decompress(data)
+            data = data.decode('utf-8')
+
+        return cls.from_dict(json.loads(data))
@@ -0,0 +1,103 @@
+"""
+SES send-rate governor for the EC2 scheduled events notification engine.
+
+The account's maximum send rate is read from get_send_quota at startup and every send_email call takes a token from
+a bucket refilled just under that rate. When SES still throttles (a retried or failed call), the rate is halved and
+then recovers additively on each successful send, up to the target rate.
+
+Note:
+    SesRateGovernor exposes the same send_email(**kwargs) as the SES client, it can be used in its place.
+
+"""
+
+import threading
+from botocore.exceptions import ClientError
+from time import sleep, time
+
+THROTTLING_CODES = ('Throttling', 'ThrottlingException', 'MaxSendingRateExceeded')
+
+
+class SesRateGovernor(object):
+
+    def __init__(self, ses_client, headroom=0.9, min_rate=0.5, max_throttle_retries=5, default_rate=1.0, paced=True):
+        self.ses_client = ses_client
+        self.paced = paced
+        self.min_rate = min_rate
+        self.max_throttle_retries = max_throttle_retries
+        try:
+            self.max_send_rate = ses_client.get_send_quota()['MaxSendRate']
+        except ClientError:
+            # Quota not readable with the account permissions, the SES sandbox rate is assumed
+            self.max_send_rate = default_rate
+        self.target_rate = max(min_rate, self.max_send_rate * headroom)
+        self.rate = self.target_rate
+        self.capacity = max(1.0, self.target_rate)
+        self.tokens = self.capacity
+        self.stats = {'sent': 0, 'throttled': 0, 'waiting': 0, 'max_waiting': 0, 'first_send': None, 'last_send': None}
+        self._updated = time()
+        self._lock = threading.Lock()
+
+    # Takes a token from the bucket, waiting for the refill when it is empty (unless pacing is disabled)
+    def _acquire(self):
+
+        if not self.paced:
+            return
+        with self._lock:
+            self.stats['waiting'] += 1
+            self.stats['max_waiting'] = max(self.stats['max_waiting'], self.stats['waiting'])
+        while True:
+            with self._lock:
+                now = time()
+                self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.stats['waiting'] -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            sleep(wait)
+
+    def _throttled(self):
+        with self._lock:
+            self.stats['throttled'] += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def _sent(self):
+        with self._lock:
+            now = time()
+            self.stats['sent'] += 1
+            self.stats['first_send'] = self.stats['first_send'] or now
+            self.stats['last_send'] = now
+            self.rate = min(self.target_rate, self.rate + self.target_rate / 10)
+
+    # Paced SES send_email, throttled calls slow the governor down and are retried
+    def send_email(self, **kwargs):
+
+        for attempt in range(self.max_throttle_retries + 1):
+            self._acquire()
+            try:
+                response = self.ses_client.send_email(**kwargs)
+            except ClientError as ex:
+                if ex.response['Error']['Code'] not in THROTTLING_CODES or attempt == self.max_throttle_retries:
+                    raise
+                self._throttled()
+                continue
+            # Throttling absorbed by the botocore retries is also a sign to slow down
+            if response.get('ResponseMetadata', {}).get('RetryAttempts'):
+                self._throttled()
+            self._sent()
+            return response
+
+    # Summary of the governor: quota, current rate, sends, throttles, waiting senders and observed send rate
+    def summary(self):
+
+        with self._lock:
+            elapsed = (self.stats['last_send'] or 0) - (self.stats['first_send'] or 0)
+            return {
+                'max_send_rate': self.max_send_rate,
+                'rate': round(self.rate, 2),
+                'sent': self.stats['sent'],
+                'throttled': self.stats['throttled'],
+                'max_waiting': self.stats['max_waiting'],
+                'send_rate': round((self.stats['sent'] - 1) / elapsed, 2) if elapsed > 0 else None
+            }
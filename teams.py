@@ -0,0 +1,112 @@
+"""
+MS Teams delivery for the EC2 scheduled events notification engine (connected via webhook connector).
+
+Events are packed per channel into a single MessageCard, one section per instance, and the card is posted once it
+reaches the section or size limit of the connector, or when flush() is called at the end of the run. All posts go
+through a persistent keep-alive session with bounded connect/read timeouts. The events of the cards that could not
+be posted are kept until take_failed() is called, the cards themselves are counted in failed_posts.
+
+"""
+
+import json
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from profiling import stage_timer
+from render import render_card, render_section
+
+# Limits of the Office 365 connector (message size is capped at 28 KB, a margin is kept for the card envelope)
+MAX_SECTIONS = 10
+MAX_CARD_BYTES = 24000
+
+
+class TeamsSender(object):
+
+    def __init__(self, timeout=(5, 15), max_sections=MAX_SECTIONS, max_card_bytes=MAX_CARD_BYTES, pool_size=10):
+        self.timeout = timeout
+        self.max_sections = max_sections
+        self.max_card_bytes = max_card_bytes
+        self.session = requests.Session()
+        # Throttled (429) and unavailable connector responses are retried with backoff, honouring Retry-After
+        retries = Retry(total=3, read=0, backoff_factor=1, status_forcelist=(429, 502, 503, 504), allowed_methods=frozenset(['POST']))
+        self.session.mount('https://', HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries))
+        self.session.headers.update({'Content-Type': 'application/json'})
+        self.posts = 0
+        self.events = 0
+        self.failed_posts = 0
+        self.failed = []
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    # Adds an event to the card of its channel, the card is posted once full
+    def add(self, chat_channel, card_title, report):
+
+        section = render_section(report)
+        section_bytes = len(json.dumps(section))
+        with self._lock:
+            pending = self._pending.setdefault((chat_channel, card_title), {'sections': [], 'reports': [], 'bytes': 0})
+            if pending['sections'] and (len(pending['sections']) >= self.max_sections or
+                                        pending['bytes'] + section_bytes > self.max_card_bytes):
+                sections, reports = pending['sections'], pending['reports']
+                pending['sections'], pending['reports'], pending['bytes'] = [], [], 0
+            else:
+                sections = None
+            pending['sections'].append(section)
+            pending['reports'].append(report)
+            pending['bytes'] += section_bytes
+
+        # A failed post does not fail the event being added: the events of the card are kept in failed and the card is
+        # counted in failed_posts
+        if sections:
+            try:
+                self._post(chat_channel, card_title, sections, reports)
+            except Exception as e:
+                print("MS teams card {} could not be posted: {}".format(card_title, e))
+
+    # Posts every pending card
+    def flush(self):
+
+        with self._lock:
+            pending_cards = [(key, pending['sections'], pending['reports']) for key, pending in self._pending.items()
+                             if pending['sections']]
+            self._pending = {}
+
+        # Every card is attempted, the first failure is raised once they have all been posted
+        error = None
+        for (chat_channel, card_title), sections, reports in pending_cards:
+            try:
+                self._post(chat_channel, card_title, sections, reports)
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            raise error
+
+    # Returns the events of the cards that could not be posted since the last call and forgets them
+    def take_failed(self):
+
+        with self._lock:
+            failed, self.failed = self.failed, []
+
+        return failed
+
+    def close(self):
+        self.flush()
+        self.session.close()
+
+    def _post(self, chat_channel, card_title, sections, reports):
+
+        try:
+            with stage_timer.span('teams post'):
+                response = self.session.post(chat_channel, json=render_card(card_title, sections), timeout=self.timeout)
+            response.raise_for_status()
+        except Exception:
+            with self._lock:
+                self.failed_posts += 1
+                self.failed.extend(reports)
+            raise
+        with self._lock:
+            self.posts += 1
+            self.events += len(sections)